@@ -7,11 +7,13 @@ Dedupe class
 
 import itertools
 import logging
+import array
 import pickle
 import multiprocessing
 import warnings
 import os
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from operator import itemgetter
 
 import numpy
 import json
@@ -23,6 +25,8 @@ import dedupe.blocking as blocking
 import dedupe.clustering as clustering
 import dedupe.datamodel as datamodel
 import dedupe.labeler as labeler
+import dedupe.mmap_index as mmap_index
+import dedupe.tfidf as tfidf
 
 logger = logging.getLogger(__name__)
 
@@ -38,14 +42,117 @@ class Matching(object):
     - `matchBlocks`
     """
 
-    def __init__(self, num_cores):
+    def __init__(self, num_cores, intern_records=False, chunk_sizer=None,
+                 backend='process', prefilter=False, prefilter_threshold=None,
+                 blocking_cores=1, hash_block_keys=False,
+                 profile_blocking=False):
         if num_cores is None:
             self.num_cores = multiprocessing.cpu_count()
         else:
             self.num_cores = num_cores
 
+        # serialize each record once to a shared file instead of once
+        # per candidate pair when sending work to scoring processes
+        self.intern_records = intern_records
+
+        # a core.ChunkSizer that decides how many record pairs are
+        # sent to a scoring process at a time
+        self.chunk_sizer = chunk_sizer
+
+        # how record pairs are scored in parallel: 'process', 'thread'
+        # or 'serial'. See core.ScoringPool
+        self.backend = backend
+
+        # bound each pair's score with the cheap comparators, and skip
+        # the expensive comparators for pairs that can't beat the
+        # threshold. See core.prefilterPairs
+        self.prefilter = prefilter
+
+        # clustering uses the scores of pairs below the clustering
+        # threshold, so matchBlocks keeps every pair unless it is
+        # given a score that pairs must beat to be clustered at all
+        self.prefilter_threshold = prefilter_threshold
+
+        # number of processes that evaluate blocking predicates. See
+        # blocking.Blocker
+        self.blocking_cores = blocking_cores
+
+        # block with 64 bit integer keys instead of strings. See
+        # blocking.hashBlockKey for how collisions are handled
+        self.hash_block_keys = hash_block_keys
+
+        # collect per predicate blocking statistics. See
+        # blockingReport
+        self.profile_blocking = profile_blocking
+
         self.loaded_indices = False
 
+        # whether both records of a pair always come from the same
+        # data, so that interned records can be keyed by id alone
+        self._same_data = False
+
+        self._reuse_pool = False
+        self._scoring_pool = None
+
+    def __enter__(self):
+        """
+        Within a with block, scoring processes are started once, on
+        first use, and reused across calls to match and matchBlocks
+        instead of being started for every call.
+        """
+        self._reuse_pool = True
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the reusable scoring processes, if they are running
+        """
+        self._reuse_pool = False
+        self._closeScoringPool()
+
+    def _closeScoringPool(self):
+        if self._scoring_pool is not None:
+            self._scoring_pool.close()
+            self._scoring_pool = None
+
+    def _scoringPool(self):
+        if not self._reuse_pool or self.num_cores < 2:
+            return None
+
+        if self._scoring_pool is None:
+            self._scoring_pool = core.ScoringPool(self.num_cores,
+                                                  self.data_model,
+                                                  self.classifier,
+                                                  self.backend)
+
+        return self._scoring_pool
+
+    def blockingReport(self, reset=False):
+        """
+        Returns statistics for each blocking predicate, of all the
+        records blocked since the last reset, with the predicates that
+        imply the most record pairs first. Blocking is only profiled if
+        the matcher was created with profile_blocking=True. See
+        blocking.BlockingProfile.report for the statistics.
+
+        Keyword arguments:
+
+        reset -- Clear the statistics after reporting them
+        """
+        blocker = getattr(self, 'blocker', None)
+        if blocker is None or blocker.profile is None:
+            raise ValueError("Blocking is not being profiled. Create the "
+                             "matcher with profile_blocking=True")
+
+        report = blocker.profile.report()
+        if reset:
+            blocker.profile.reset()
+
+        return report
+
     def thresholdBlocks(self, blocks, recall_weight=1.5):  # pragma: nocover
         """
         Returns the threshold that maximizes the expected F score, a
@@ -68,7 +175,12 @@ class Matching(object):
         probability = core.scoreDuplicates(candidate_records,
                                            self.data_model,
                                            self.classifier,
-                                           self.num_cores)['score']
+                                           self.num_cores,
+                                           intern_records=self.intern_records,
+                                           chunk_sizer=self.chunk_sizer,
+                                           pool=self._scoringPool(),
+                                           backend=self.backend,
+                                           same_data=self._same_data)['score']
 
         probability = probability.copy()
         probability.sort()
@@ -111,16 +223,43 @@ class Matching(object):
         """
         candidate_records = itertools.chain.from_iterable(self._blockedPairs(blocks))
 
+        # Score and cluster dense integer ids instead of the record
+        # ids, which can be long strings, and only look up the record
+        # ids again as clusters are emitted. An unsigned 32 bit integer
+        # is plenty, no one will score pairs from 4 billion records
+        id_index = core.Enumerator()
+        candidate_records = core.internIds(candidate_records, id_index)
+
+        score_threshold = 0
+        if self.prefilter:
+            if self.prefilter_threshold is None:
+                warnings.warn("prefilter has no effect in matchBlocks "
+                              "unless the matcher is also given a "
+                              "prefilter_threshold")
+            else:
+                score_threshold = self.prefilter_threshold
+
         matches = core.scoreDuplicates(candidate_records,
                                        self.data_model,
                                        self.classifier,
                                        self.num_cores,
-                                       threshold=0)
+                                       threshold=score_threshold,
+                                       intern_records=self.intern_records,
+                                       id_type='u4',
+                                       chunk_sizer=self.chunk_sizer,
+                                       pool=self._scoringPool(),
+                                       backend=self.backend,
+                                       prefilter=self.prefilter,
+                                       same_data=self._same_data)
 
         logger.debug("matching done, begin clustering")
 
-        for cluster in self._cluster(matches, threshold, *args, **kwargs):
-            yield cluster
+        record_ids = list(id_index)
+        del id_index
+
+        for cluster_ids, score in self._cluster(matches, threshold,
+                                                *args, **kwargs):
+            yield tuple(record_ids[i] for i in cluster_ids), score
 
         try:
             match_file = matches.filename
@@ -129,13 +268,21 @@ class Matching(object):
         except AttributeError:
             pass
 
-    def writeSettings(self, file_obj, index=False):  # pragma: no cover
+    def writeSettings(self, file_obj, index=False,
+                      index_directory=None):  # pragma: no cover
         """
         Write a settings file containing the
         data model and predicates to a file object
 
         Keyword arguments:
         file_obj -- file object to write settings data into
+        index -- also write the fitted indices
+        index_directory -- write the TF-IDF indices and canopies to
+                           this directory as arrays that are
+                           memory-mapped when the settings are loaded,
+                           instead of pickling them into file_obj. Docs
+                           indexed or unindexed after loading are only
+                           kept in memory.
         """
 
         pickle.dump(self.data_model, file_obj)
@@ -143,15 +290,37 @@ class Matching(object):
         pickle.dump(self.predicates, file_obj)
 
         if index:
-            self._writeIndices(file_obj)
+            self._writeIndices(file_obj, index_directory)
 
-    def _writeIndices(self, file_obj):
+    def _writeIndices(self, file_obj, index_directory=None):
         indices = {}
         doc_to_ids = {}
         canopies = {}
+        mmap_indices = {}
         for full_predicate in self.predicates:
             for predicate in full_predicate:
                 if hasattr(predicate, 'index') and predicate.index:
+                    if (index_directory is not None and
+                            isinstance(predicate.index,
+                                       (tfidf.TfIdfIndex,
+                                        tfidf.CsrTfIdfIndex))):
+                        index = predicate.index
+                        if id(index) not in mmap_indices:
+                            name = str(len(mmap_indices))
+                            mmap_index.writeIndex(
+                                index, os.path.join(index_directory, name))
+                            mmap_indices[id(index)] = mmap_index.IndexFile(
+                                index_directory, name)
+                        indices[predicate] = mmap_indices[id(index)]
+                        if hasattr(predicate, "canopy"):
+                            name = 'canopy_%d.npy' % len(canopies)
+                            mmap_index.writeCanopy(
+                                predicate.canopy,
+                                os.path.join(index_directory, name))
+                            canopies[predicate] = mmap_index.IndexFile(
+                                index_directory, name)
+                        continue
+
                     doc_to_ids[predicate] = dict(predicate.index._doc_to_id)
                     if hasattr(predicate, "canopy"):
                         canopies[predicate] = predicate.canopy
@@ -182,9 +351,26 @@ class DedupeMatching(Matching):
 
     ActiveLearner = labeler.DedupeDisagreementLearner
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, compact_blocks=False, blocking_buffer_size=None,
+                 max_block_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self._cluster = clustering.cluster
+        self._same_data = True
+
+        # keep one sorted array of block ids per record, instead of a
+        # set of smaller block keys per record and block. See
+        # core.SmallerBlocks
+        self.compact_blocks = compact_blocks
+
+        # if set, build blocks on disk, holding at most this many
+        # block keys in memory at once, instead of building the block
+        # map in memory
+        self.blocking_buffer_size = blocking_buffer_size
+
+        # blocks with more records than this are split into their
+        # intersections with the records' other large blocks. See
+        # _capBlocks
+        self.max_block_size = max_block_size
 
     def match(self, data, threshold=0.5, generator=False):  # pragma: no cover
         """Identifies records that all refer to the same entity, returns
@@ -261,6 +447,11 @@ class DedupeMatching(Matching):
 
     def _blockData(self, data_d):
 
+        if self.blocking_buffer_size:
+            yield from self._externalBlockData(data_d,
+                                               self.blocking_buffer_size)
+            return
+
         blocks = {}
         coverage = {}
 
@@ -282,9 +473,20 @@ class DedupeMatching(Matching):
         if not self.loaded_indices:
             self.blocker.resetIndices()
 
+        if self.blocker.profile is not None:
+            self.blocker.profile.countBlocks(blocks)
+
         blocks = {block_key: record_ids for block_key, record_ids
                   in blocks.items() if len(record_ids) > 1}
 
+        if self.max_block_size:
+            blocks, coverage = self._capBlocks(blocks, coverage,
+                                               self.max_block_size)
+
+        if self.compact_blocks:
+            yield from self._compactBlocks(data_d, blocks, coverage)
+            return
+
         coverage = {record_id: [k for k in cover if k in blocks]
                     for record_id, cover in coverage.items()}
 
@@ -297,6 +499,129 @@ class DedupeMatching(Matching):
 
             yield processed_block
 
+    def _capBlocks(self, blocks, coverage, max_block_size):
+        '''
+        Replace blocks with more than max_block_size records by their
+        intersections with the other oversized blocks, as if blocking
+        with compound keys. See blocking.splitBlocks
+        '''
+        oversized = {block_key: record_ids
+                     for block_key, record_ids in blocks.items()
+                     if len(record_ids) > max_block_size}
+        if not oversized:
+            return blocks, coverage
+
+        sub_blocks = self._splitBlocks(oversized, max_block_size)
+
+        for block_key in oversized:
+            del blocks[block_key]
+        blocks.update(sub_blocks)
+
+        sub_coverage = defaultdict(list)
+        for sub_key, record_ids in sub_blocks.items():
+            for record_id in record_ids:
+                sub_coverage[record_id].append(sub_key)
+
+        for record_id in set().union(*oversized.values()):
+            coverage[record_id] = ([k for k in coverage[record_id]
+                                    if k not in oversized] +
+                                   sub_coverage[record_id])
+
+        return blocks, coverage
+
+    def _splitBlocks(self, oversized, max_block_size):
+        for block_key, record_ids in oversized.items():
+            logger.warning('Block %s has %d records, more than the '
+                           'max_block_size of %d. It will be split into its '
+                           'intersections with other blocks over the cap',
+                           block_key, len(record_ids), max_block_size)
+
+        sub_blocks, dropped, lost_pairs = blocking.splitBlocks(oversized,
+                                                               max_block_size)
+
+        logger.warning('Split %d oversized blocks into %d sub-blocks, and '
+                       'dropped %d intersections that could not be split '
+                       'under the cap. At least %d pairs of the oversized '
+                       'blocks are in no sub-block, and are only compared '
+                       'if their records share a block under the cap',
+                       len(oversized), len(sub_blocks), dropped, lost_pairs)
+
+        return sub_blocks
+
+    def _compactBlocks(self, data_d, blocks, coverage):
+        block_ids = {block_key: i for i, block_key in enumerate(blocks)}
+
+        coverage = {record_id: array.array('I', sorted(block_ids[k]
+                                                       for k in cover
+                                                       if k in block_ids))
+                    for record_id, cover in coverage.items()}
+
+        for block_key, block in blocks.items():
+            block_id = block_ids[block_key]
+            yield [(record_id,
+                    data_d[record_id],
+                    core.SmallerBlocks(coverage[record_id], block_id))
+                   for record_id in block]
+
+    def _externalBlockData(self, data_d, buffer_size):
+        '''
+        Like _blockData, but the block map is sorted on disk, so memory
+        is bounded by buffer_size and by the size of the largest block.
+        Blocks are numbered in the order of their keys, and the smaller
+        ids of a record are the numbers of its smaller blocks. Blocks
+        over max_block_size are held in memory and split as in
+        _capBlocks, after the blocks under the cap are numbered.
+        '''
+        if not self.loaded_indices:
+            self.blocker.indexAll(data_d)
+
+        block_map = core.externalSort(self.blocker(data_d.items()),
+                                      buffer_size)
+
+        if not self.loaded_indices:
+            self.blocker.resetIndices()
+
+        max_block_size = self.max_block_size
+        profile = self.blocker.profile
+
+        def recordBlocks():
+            block_id = 0
+            oversized = {}
+            for block_key, block in itertools.groupby(block_map,
+                                                      itemgetter(0)):
+                record_ids = [record_id for _, record_id in block]
+                if profile is not None and len(record_ids) > 1:
+                    profile.countBlock(block_key, len(record_ids))
+                if max_block_size and len(record_ids) > max_block_size:
+                    oversized[block_key] = record_ids
+                elif len(record_ids) > 1:
+                    for record_id in record_ids:
+                        yield record_id, block_id
+                    block_id += 1
+
+            if oversized:
+                sub_blocks = self._splitBlocks(oversized, max_block_size)
+                for record_ids in sub_blocks.values():
+                    for record_id in record_ids:
+                        yield record_id, block_id
+                    block_id += 1
+
+        coverage = core.externalSort(recordBlocks(), buffer_size)
+
+        def smallerBlocks():
+            for record_id, cover in itertools.groupby(coverage,
+                                                      itemgetter(0)):
+                block_ids = [block_id for _, block_id in cover]
+                for i, block_id in enumerate(block_ids):
+                    yield block_id, record_id, block_ids[:i]
+
+        blocks = core.externalSort(smallerBlocks(), buffer_size,
+                                   key=itemgetter(0, 1))
+
+        for _, block in itertools.groupby(blocks, itemgetter(0)):
+            yield [(record_id, data_d[record_id], set(smaller_ids))
+                   for _, record_id, smaller_ids in block]
+
     def _checkBlock(self, block):
         if block:
             try:
@@ -416,6 +741,7 @@ class RecordLinkMatching(Matching):
     def _blockGenerator(self, messy_data, blocked_records):
         block_groups = itertools.groupby(self.blocker(messy_data.items()),
                                          lambda x: x[1])
+        profile = self.blocker.profile
 
         for i, (record_id, block_keys) in enumerate(block_groups):
             if i % 100 == 0:
@@ -428,6 +754,10 @@ class RecordLinkMatching(Matching):
             for block_key, _ in block_keys:
                 if block_key in blocked_records:
                     B.update(blocked_records[block_key])
+                    if profile is not None:
+                        n_targets = len(blocked_records[block_key])
+                        profile.countBlock(block_key, n_targets + 1,
+                                           n_targets)
 
             B = [(rec_id, record, set())
                  for rec_id, record
@@ -487,7 +817,8 @@ class StaticMatching(Matching):
 
     def __init__(self,
                  settings_file,
-                 num_cores=None, **kwargs):  # pragma: no cover
+                 num_cores=None,
+                 index_directory=None, **kwargs):  # pragma: no cover
         """
         Initialize from a settings file
         #### Example usage
@@ -501,6 +832,11 @@ class StaticMatching(Matching):
         `settings_file`
         A file object containing settings data.
 
+        `index_directory`
+        Where the memory-mapped indices written by
+        [`writeSettings`][[api.py#writesettings]] are now, if they
+        have been moved since. Defaults to the directory they were
+        written to.
 
         Settings files are typically generated by saving the settings
         learned from ActiveMatching. If you need details for this
@@ -523,7 +859,7 @@ class StaticMatching(Matching):
                 "Try deleting the file")
 
         try:
-            self._loadIndices(settings_file)
+            self._loadIndices(settings_file, index_directory)
         except EOFError:
             pass
         except (KeyError, AttributeError):
@@ -538,16 +874,32 @@ class StaticMatching(Matching):
 
         logger.info(self.predicates)
 
-        self.blocker = blocking.Blocker(self.predicates)
+        self.blocker = blocking.Blocker(self.predicates,
+                                        self.blocking_cores,
+                                        self.hash_block_keys,
+                                        self.profile_blocking)
 
-    def _loadIndices(self, settings_file):
+    def _loadIndices(self, settings_file, index_directory=None):
         canopies = pickle.load(settings_file)
         indices = pickle.load(settings_file)
         doc_to_ids = pickle.load(settings_file)
 
+        mmap_indices = {}
         for full_predicate in self.predicates:
             for predicate in full_predicate:
                 if hasattr(predicate, "index") and predicate.index is None:
+                    index_file = indices.get(predicate)
+                    if isinstance(index_file, mmap_index.IndexFile):
+                        path = index_file.path(index_directory)
+                        if path not in mmap_indices:
+                            mmap_indices[path] = mmap_index.MmapTfIdfIndex(
+                                path)
+                        predicate.index = mmap_indices[path]
+                        if hasattr(predicate, "canopy"):
+                            predicate.canopy = mmap_index.MmapCanopy(
+                                canopies[predicate].path(index_directory))
+                        continue
+
                     predicate.index = predicate.initIndex()
                     max_id = max(doc_to_ids[predicate].values())
                     predicate.index._doc_to_id = core.Enumerator(max_id + 1,
@@ -684,9 +1036,15 @@ class ActiveMatching(Matching):
         examples, y = flatten_training(self.training_pairs)
         self.classifier.fit(self.data_model.distances(examples), y)
 
+        # running scoring processes have the old classifier
+        self._closeScoringPool()
+
         self.predicates = self.active_learner.learn_predicates(
             recall, index_predicates)
-        self.blocker = blocking.Blocker(self.predicates)
+        self.blocker = blocking.Blocker(self.predicates,
+                                        self.blocking_cores,
+                                        self.hash_block_keys,
+                                        self.profile_blocking)
         self.blocker.resetIndices()
 
     def writeTraining(self, file_obj):  # pragma: no cover
@@ -976,7 +1334,7 @@ class GazetteerMatching(RecordLinkMatching):
             except KeyError:
                 pass
 
-    def matchBlocks(self, blocks, threshold=.5, *args, **kwargs):
+    def matchBlocks(self, blocks, threshold=.5, n_matches=1, *args, **kwargs):
         """
         Partitions blocked data and generates a sequence of clusters, where
         each cluster is a tuple of record ids
@@ -994,6 +1352,9 @@ class GazetteerMatching(RecordLinkMatching):
                       Lowering the number will increase recall,
                       raising it will increase precision
 
+        n_matches -- Maximum number of possible matches from the
+                     canonical record set to match against each record
+                     in the messy record set
         """
         candidate_records = self._blockedPairs(blocks)
 
@@ -1001,11 +1362,15 @@ class GazetteerMatching(RecordLinkMatching):
                                     self.data_model,
                                     self.classifier,
                                     self.num_cores,
-                                    threshold=threshold)
+                                    threshold=threshold,
+                                    n_matches=n_matches,
+                                    pool=self._scoringPool(),
+                                    backend=self.backend,
+                                    prefilter=self.prefilter)
 
         logger.debug("matching done, begin clustering")
 
-        return self._cluster(matches, *args, **kwargs)
+        return self._cluster(matches, n_matches, *args, **kwargs)
 
     def match(self, messy_data, threshold=0.5, n_matches=1, generator=False):  # pragma: no cover
         """Identifies pairs of records that refer to the same entity, returns
@@ -1064,15 +1429,18 @@ class GazetteerMatching(RecordLinkMatching):
         blocked_pairs = self._blockData(messy_data)
         return self.thresholdBlocks(blocked_pairs, recall_weight)
 
-    def writeSettings(self, file_obj, index=False):  # pragma: no cover
+    def writeSettings(self, file_obj, index=False,
+                      index_directory=None):  # pragma: no cover
         """
         Write a settings file containing the
         data model and predicates to a file object
 
         Keyword arguments:
         file_obj -- file object to write settings data into
+        index -- also write the blocked records and fitted indices
+        index_directory -- see Matching.writeSettings
         """
-        super().writeSettings(file_obj, index)
+        super().writeSettings(file_obj, index, index_directory)
 
         if index:
             pickle.dump(self.blocked_records, file_obj)
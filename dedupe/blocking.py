@@ -1,10 +1,15 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from collections import defaultdict
+from collections import defaultdict, deque, Counter
+import hashlib
+import itertools
 import logging
+import multiprocessing
 import time
 
+from . import tfidf
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,9 +20,17 @@ def index_list():
 class Blocker:
     '''Takes in a record and returns all blocks that record belongs to'''
 
-    def __init__(self, predicates):
+    def __init__(self, predicates, num_cores=1, hash_keys=False,
+                 profile=False):
 
         self.predicates = predicates
+        self.num_cores = num_cores
+        self.hash_keys = hash_keys
+
+        if profile:
+            self.profile = BlockingProfile(predicates)
+        else:
+            self.profile = None
 
         self.index_fields = defaultdict(index_list)
         self.index_predicates = []
@@ -25,7 +38,10 @@ class Blocker:
         for full_predicate in predicates:
             for predicate in full_predicate:
                 if hasattr(predicate, 'index'):
-                    self.index_fields[predicate.field][predicate.type].append(
+                    # predicates of a type share an index, if they use
+                    # the same kind of index
+                    index_type = (predicate.type, predicate.index_class)
+                    self.index_fields[predicate.field][index_type].append(
                         predicate)
                     self.index_predicates.append(predicate)
 
@@ -36,19 +52,97 @@ class Blocker:
                       for i, predicate
                       in enumerate(self.predicates)]
 
-        for i, record in enumerate(records):
-            record_id, instance = record
+        if self.num_cores > 1 and canFork():
+            record_blocks = self._parallelBlocks(records, predicates, target,
+                                                 self.profile)
+        else:
+            record_blocks = self._blocks(records, predicates, target,
+                                         self.profile)
+
+        if self.hash_keys:
+            # a record's keys that collide are kept once, so that the
+            # record is only put in their block once
+            record_blocks = ((record_id,
+                              dict.fromkeys(map(hashBlockKey, block_keys)))
+                             for record_id, block_keys in record_blocks)
 
-            for pred_id, predicate in predicates:
-                block_keys = predicate(instance, target=target)
-                for block_key in block_keys:
-                    yield block_key + pred_id, record_id
+        for i, (record_id, block_keys) in enumerate(record_blocks):
+            for block_key in block_keys:
+                yield block_key, record_id
 
             if i and i % 10000 == 0:
                 logger.info('%(iteration)d, %(elapsed)f2 seconds',
                             {'iteration': i,
                              'elapsed': time.perf_counter() - start_time})
 
+    def _blocks(self, records, predicates, target, profile,
+                chunk_size=1000):
+        '''
+        Evaluate predicates on chunks of records, so that index
+        predicates can search for all of a chunk's records at once
+        '''
+        records = iter(records)
+        for chunk in iter(lambda: list(itertools.islice(records, chunk_size)),
+                          []):
+            chunk_keys = blockChunk(predicates,
+                                    [instance for _, instance in chunk],
+                                    target, profile)
+            for (record_id, _), block_keys in zip(chunk, chunk_keys):
+                yield record_id, block_keys
+
+    def _parallelBlocks(self, records, predicates, target, profile,
+                        chunk_size=1000):
+        '''
+        Evaluate predicates on chunks of records in worker processes.
+
+        The workers are forked after the indices are built, so each
+        has a read-only copy of the fitted indices. Canopy predicates
+        depend on the order that records are blocked in, so they are
+        still evaluated here, one record at a time.
+        '''
+        sequential = []
+        parallel = []
+        for pred_id, predicate in predicates:
+            if any(hasattr(pred, 'canopy') for pred in predicate):
+                sequential.append((pred_id, predicate))
+            else:
+                parallel.append((pred_id, predicate))
+
+        if not parallel:
+            yield from self._blocks(records, sequential, target, profile,
+                                    chunk_size)
+            return
+
+        records = iter(records)
+        chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+
+        # the pool reads ahead in another thread, so hold on to the
+        # chunks it has taken until their results come back
+        pending = deque()
+
+        def tasks():
+            for chunk in chunks:
+                pending.append(chunk)
+                yield [instance for _, instance in chunk]
+
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.num_cores,
+                          initializer=_initBlocker,
+                          initargs=(parallel, target,
+                                    profile is not None)) as pool:
+            for chunk_keys, chunk_profile in pool.imap(_blockChunk, tasks()):
+                if profile is not None:
+                    profile.update(chunk_profile)
+
+                chunk = pending.popleft()
+                sequential_keys = blockChunk(sequential,
+                                             [instance for _, instance in chunk],
+                                             target, profile)
+                for (record_id, _), block_keys, more_keys in zip(
+                        chunk, chunk_keys, sequential_keys):
+                    block_keys.extend(more_keys)
+                    yield record_id, block_keys
+
     def resetIndices(self):
         # clear canopies to reduce memory usage
         for predicate in self.index_predicates:
@@ -75,20 +169,21 @@ class Blocker:
         '''Remove index of a given set of data'''
         indices = extractIndices(self.index_fields[field])
 
-        for doc in data:
-            if doc:
-                for _, index, preprocess in indices:
-                    index.unindex(preprocess(doc))
+        docs = {doc for doc in data if doc}
 
-        for index_type, index, _ in indices:
+        for index_type, index, preprocess in indices:
 
-            index._index.initSearch()
+            index.unindexAll({preprocess(doc) for doc in docs})
 
             for predicate in self.index_fields[field][index_type]:
                 logger.debug("Canopy: %s", str(predicate))
                 predicate.index = index
 
     def indexAll(self, data_d):
+        if self.num_cores > 1 and canFork():
+            self._parallelIndexAll(data_d)
+            return
+
         for field in self.index_fields:
             unique_fields = {record[field]
                              for record
@@ -96,6 +191,346 @@ class Blocker:
                              if record[field]}
             self.index(unique_fields, field)
 
+    def _parallelIndexAll(self, data_d, min_shard_size=1000):
+        '''
+        Build the TF-IDF indices of all fields at once in worker
+        processes. Each index's new docs are numbered here, split into
+        shards that are indexed separately and then merged into the
+        index. Levenshtein indices live in C module state that can't be
+        sent between processes, so they are built here, while the
+        workers build the TF-IDF indices.
+        '''
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.num_cores) as pool:
+            tfidf_indices = []
+            other_indices = []
+
+            for field in self.index_fields:
+                unique_fields = {record[field]
+                                 for record
+                                 in data_d.values()
+                                 if record[field]}
+
+                for index_type, index, preprocess in extractIndices(
+                        self.index_fields[field]):
+                    if isinstance(index, tfidf.TfIdfIndex):
+                        docs = index.numberDocs(preprocess(doc)
+                                                for doc in unique_fields)
+                        n_shards = min(self.num_cores,
+                                       max(len(docs) // min_shard_size, 1))
+                        shards = [docs[i::n_shards] for i in range(n_shards)]
+                        result = pool.map_async(tfidf.indexShard, shards)
+                        tfidf_indices.append((field, index_type, index,
+                                              result))
+                    else:
+                        other_indices.append((field, index_type, index,
+                                              preprocess, unique_fields))
+
+            for field, index_type, index, preprocess, docs in other_indices:
+                for doc in docs:
+                    index.index(preprocess(doc))
+                self._initIndex(field, index_type, index)
+
+            for field, index_type, index, result in tfidf_indices:
+                index.merge(result.get())
+                self._initIndex(field, index_type, index)
+
+    def _initIndex(self, field, index_type, index):
+        index.initSearch()
+
+        for predicate in self.index_fields[field][index_type]:
+            logger.debug("Canopy: %s", str(predicate))
+            predicate.index = index
+
+
+def blockKeys(predicates, instance, target):
+    return [block_key + pred_id
+            for pred_id, predicate in predicates
+            for block_key in predicate(instance, target=target)]
+
+
+def blockChunk(predicates, instances, target, profile=None):
+    '''
+    Block keys of each of a chunk of records. Index predicates first
+    search their index for all of the records at once.
+
+    When profiling, each predicate is evaluated on the whole chunk in
+    turn, so that it is timed once per chunk instead of once per record.
+    '''
+    for pred_id, predicate in predicates:
+        for pred in predicate:
+            if hasattr(pred, 'searchAll'):
+                if profile is None:
+                    pred.searchAll(instances, target)
+                else:
+                    start_time = time.perf_counter()
+                    pred.searchAll(instances, target)
+                    profile.seconds[pred_id] += time.perf_counter() - start_time
+
+    if profile is None:
+        return [blockKeys(predicates, instance, target)
+                for instance in instances]
+
+    chunk_keys = [[] for _ in instances]
+    for pred_id, predicate in predicates:
+        start_time = time.perf_counter()
+        n_records = 0
+        n_keys = 0
+        for block_keys, instance in zip(chunk_keys, instances):
+            n_before = len(block_keys)
+            block_keys.extend(block_key + pred_id
+                              for block_key
+                              in predicate(instance, target=target))
+            if len(block_keys) > n_before:
+                n_records += 1
+                n_keys += len(block_keys) - n_before
+
+        profile.seconds[pred_id] += time.perf_counter() - start_time
+        profile.records[pred_id] += n_records
+        profile.keys[pred_id] += n_keys
+
+    return chunk_keys
+
+
+class BlockingProfile(object):
+    '''
+    Per predicate statistics of the records a Blocker has blocked: the
+    time spent evaluating the predicate, the number of records it gave
+    at least one key to, the number of keys it emitted, and the sizes
+    of its blocks.
+
+    Time and keys are counted by the Blocker, one timing per predicate
+    and chunk of records. Block sizes are counted by the matcher, from
+    the blocks it builds anyway, and only their histogram is kept.
+    Statistics add up over calls to the blocker until reset().
+    '''
+
+    def __init__(self, predicates=()):
+        self.predicates = predicates
+        self.reset()
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.records = defaultdict(int)
+        self.keys = defaultdict(int)
+        self._block_sizes = defaultdict(Counter)
+        self._max_block_size = defaultdict(int)
+        self._pairs = defaultdict(int)
+
+    def update(self, other):
+        '''
+        Add the time and keys counted by another profile, of a blocking
+        worker process
+        '''
+        for pred_id, seconds in other.seconds.items():
+            self.seconds[pred_id] += seconds
+        for pred_id, records in other.records.items():
+            self.records[pred_id] += records
+        for pred_id, keys in other.keys.items():
+            self.keys[pred_id] += keys
+
+    def countBlocks(self, blocks):
+        '''
+        Count the blocks with more than one record of a dict of block
+        keys to the records in each block
+        '''
+        for block_key, records in blocks.items():
+            if len(records) > 1:
+                self.countBlock(block_key, len(records))
+
+    def countBlock(self, block_key, size, pairs=None):
+        if pairs is None:
+            pairs = _pairs(size)
+
+        pred_id = predicateId(block_key)
+        self._block_sizes[pred_id][2 ** (size - 1).bit_length()] += 1
+        if size > self._max_block_size[pred_id]:
+            self._max_block_size[pred_id] = size
+        self._pairs[pred_id] += pairs
+
+    def report(self):
+        '''
+        Returns a list with a dictionary of statistics for each
+        predicate, the predicates that imply the most record pairs
+        first. `block_sizes` is a histogram of the blocks with more
+        than one record, keyed by powers of two: the blocks counted
+        under n have more than n / 2 and at most n records. `pairs`
+        is the number of record pairs those blocks imply.
+
+        For record linkage, a block is a record of the first dataset
+        with the records of the second dataset that share one of its
+        keys, and its pairs are the pairs of that record with those
+        records.
+        '''
+        report = []
+        for i, predicate in enumerate(self.predicates):
+            pred_id = ':' + str(i)
+            histogram = self._block_sizes[pred_id]
+
+            report.append({'predicate': predicate.__name__,
+                           'seconds': self.seconds[pred_id],
+                           'records': self.records[pred_id],
+                           'keys': self.keys[pred_id],
+                           'blocks': sum(histogram.values()),
+                           'max_block_size': self._max_block_size[pred_id],
+                           'pairs': self._pairs[pred_id],
+                           'block_sizes': dict(sorted(histogram.items()))})
+
+        report.sort(key=lambda stats: stats['pairs'], reverse=True)
+
+        return report
+
+
+def predicateId(block_key):
+    '''
+    The ':<predicate index>' suffix of a block key, or of the block key
+    a key was hashed from
+    '''
+    if isinstance(block_key, str):
+        return block_key[block_key.rindex(':'):]
+    else:
+        return ':%d' % (block_key >> 64)
+
+
+def hashKey(string):
+    '''
+    Hash a string to a signed 64 bit integer. The hash is stable across
+    processes and runs, so hashes can be saved with the settings.
+    '''
+    digest = hashlib.blake2b(string.encode('utf-8'), digest_size=8)
+    return int.from_bytes(digest.digest(), 'little', signed=True)
+
+
+_HASH_MASK = 2 ** 64 - 1
+
+
+def hashBlockKey(block_key):
+    '''
+    Hash a block key to an integer that keeps the index of the key's
+    predicate apart from the hash of the rest of the key, as
+    `predicate_index << 64 | hash`. The predicate index of a hashed key
+    is `hashed_key >> 64`.
+
+    Collisions are not detected. Keys of different predicates never
+    collide, and with n distinct keys of one predicate about
+    n ** 2 / 2 ** 65 collisions are expected, well under one for a
+    billion keys. When keys of different records collide, their blocks
+    become one block, which adds candidate pairs but loses none, and
+    each pair is still scored once. When keys of the same record
+    collide, the Blocker keeps the hashed key once, so the record is
+    not in the block twice.
+    '''
+    key, _, pred_index = block_key.rpartition(':')
+    return int(pred_index) << 64 | hashKey(key) & _HASH_MASK
+
+
+def compoundKey(block_key_1, block_key_2):
+    '''
+    Key of the block of records that are in both of two blocks
+    '''
+    if isinstance(block_key_1, str):
+        return block_key_1 + '&' + block_key_2
+    else:
+        # keep the predicate of the first block
+        return (block_key_1 >> 64 << 64 |
+                hashKey('%d&%d' % (block_key_1, block_key_2)) & _HASH_MASK)
+
+
+def splitBlocks(oversized, max_block_size):
+    '''
+    Split blocks with more than max_block_size records, a dict of
+    block keys to lists of record ids, into their intersections with
+    each other, as if blocking with compound keys. Intersections that
+    are still over the cap are intersected with the records' other
+    oversized blocks in turn, until they are under the cap or there is
+    nothing left to intersect them with.
+
+    Intersecting with blocks under the cap would add no pairs, since
+    those blocks are compared whole.
+
+    Returns a dict of the sub-blocks with more than one record and at
+    most max_block_size, the number of intersections that were dropped
+    because they could not be split under the cap, and a lower bound on
+    the number of pairs of the oversized blocks that are in none of the
+    sub-blocks. Those pairs are only compared if their records share a
+    block under the cap.
+    '''
+    record_keys = defaultdict(list)
+    for block_key in sorted(oversized):
+        for record_id in oversized[block_key]:
+            record_keys[record_id].append(block_key)
+
+    sub_blocks = {}
+    recovered = Counter()
+    dropped = 0
+
+    # an intersection is only intersected with the blocks that sort
+    # after all of its parts, so that each one is made once
+    stack = [((block_key,), block_key, record_ids)
+             for block_key, record_ids in oversized.items()]
+    while stack:
+        parts, key, record_ids = stack.pop()
+
+        children = defaultdict(list)
+        for record_id in record_ids:
+            for block_key in record_keys[record_id]:
+                if block_key > parts[-1]:
+                    children[block_key].append(record_id)
+
+        split = False
+        for block_key, child_ids in children.items():
+            if len(child_ids) < 2:
+                continue
+            split = True
+            child_parts = parts + (block_key,)
+            child_key = compoundKey(key, block_key)
+            if len(child_ids) > max_block_size:
+                stack.append((child_parts, child_key, child_ids))
+            else:
+                sub_blocks[child_key] = child_ids
+                for part in child_parts:
+                    recovered[part] += _pairs(len(child_ids))
+
+        if len(parts) > 1 and not split:
+            dropped += 1
+
+    # sub-blocks of the same block can overlap, so their pairs can be
+    # counted more than once in recovered
+    lost_pairs = sum(max(_pairs(len(record_ids)) - recovered[block_key], 0)
+                     for block_key, record_ids in oversized.items())
+
+    return sub_blocks, dropped, lost_pairs
+
+
+def _pairs(n_records):
+    return n_records * (n_records - 1) // 2
+
+
+def canFork():
+    from .backport import MULTIPROCESSING
+    return (MULTIPROCESSING and
+            'fork' in multiprocessing.get_all_start_methods())
+
+
+# the predicates that a blocking worker process evaluates
+_blocker = None
+
+
+def _initBlocker(predicates, target, profile):
+    global _blocker
+    _blocker = (predicates, target, profile)
+
+
+def _blockChunk(instances):
+    predicates, target, profile = _blocker
+
+    if profile:
+        profile = BlockingProfile()
+    else:
+        profile = None
+
+    return blockChunk(predicates, instances, target, profile), profile
+
 
 def extractIndices(index_fields):
 
@@ -115,6 +115,9 @@ def condensedDistance(dupes):
     i_to_id = dict(enumerate(candidate_set))
 
     ids = candidate_set.searchsorted(dupes['pairs'])
+    # the formula needs row < col, which will not hold if record ids
+    # have been replaced by integers in the order they were seen
+    ids.sort(axis=1)
     row = ids[:, 0]
     col = ids[:, 1]
 
@@ -7,8 +7,11 @@ import tempfile
 import os
 import random
 import collections
+import heapq
 import warnings
 import functools
+import pickle
+import mmap
 
 import numpy
 
@@ -88,11 +91,16 @@ def randomPairsWithReplacement(n_records, sample_size):
 
 
 class ScoreDupes(object):
-    def __init__(self, data_model, classifier, threshold):
+    def __init__(self, data_model, classifier, threshold, record_store=None,
+                 id_type=None, prefilter=False):
         self.data_model = data_model
         self.classifier = classifier
         self.threshold = threshold
         self.score_queue = None
+        self.record_store = record_store
+        self.id_type = id_type
+        self.prefilter = prefilter
+        self._record_reader = None
 
     def __call__(self, records_queue, score_queue):
         self.score_queue = score_queue
@@ -102,7 +110,10 @@ class ScoreDupes(object):
                 break
 
             try:
-                filtered_pairs = self.fieldDistance(record_pairs)
+                if self.record_store is None:
+                    filtered_pairs = self.fieldDistance(record_pairs)
+                else:
+                    filtered_pairs = self.storedFieldDistance(record_pairs)
                 if filtered_pairs is not None:
                     score_queue.put(filtered_pairs)
             except Exception as e:
@@ -111,6 +122,11 @@ class ScoreDupes(object):
 
         score_queue.put(None)
 
+    def close(self):
+        if self._record_reader is not None:
+            self._record_reader.close()
+            self._record_reader = None
+
     def fieldDistance(self, record_pairs):
         ids = []
         records = []
@@ -125,89 +141,312 @@ class ScoreDupes(object):
                 records.append((record_1, record_2))
 
         if records:
+            return self.score(ids, records)
 
-            distances = self.data_model.distances(records)
-            scores = self.classifier.predict_proba(distances)[:, -1]
+    def storedFieldDistance(self, record_locations):
+        if self._record_reader is None:
+            self._record_reader = RecordReader(self.record_store)
+
+        read = self._record_reader.read
+        cache = {}
+
+        ids = []
+        records = []
+
+        for offset_1, length_1, offset_2, length_2 in record_locations.tolist():
+            try:
+                id_1, record_1 = cache[offset_1]
+            except KeyError:
+                id_1, record_1 = cache[offset_1] = read(offset_1, length_1)
+            try:
+                id_2, record_2 = cache[offset_2]
+            except KeyError:
+                id_2, record_2 = cache[offset_2] = read(offset_2, length_2)
 
-            mask = scores > self.threshold
-            if mask.any():
-                id_type = sniff_id_type(ids)
-                ids = numpy.array(ids, dtype=id_type)
+            ids.append((id_1, id_2))
+            records.append((record_1, record_2))
 
-                dtype = numpy.dtype([('pairs', id_type, 2),
-                                     ('score', 'f4')])
+        if records:
+            return self.score(ids, records)
+
+    def score(self, ids, records):
+        if self.prefilter:
+            ids, records = prefilterPairs(self.data_model, self.classifier,
+                                          self.threshold, ids, records)
+            if not records:
+                return None
+
+        distances = self.data_model.distances(records)
+        scores = self.classifier.predict_proba(distances)[:, -1]
+
+        mask = scores > self.threshold
+        if mask.any():
+            id_type = self.id_type or sniff_id_type(ids)
+            ids = numpy.array(ids, dtype=id_type)
+
+            dtype = numpy.dtype([('pairs', id_type, 2),
+                                 ('score', 'f4')])
+
+            scored_pairs = numpy.empty(shape=numpy.count_nonzero(mask),
+                                       dtype=dtype)
+
+            scored_pairs['pairs'] = ids[mask]
+            scored_pairs['score'] = scores[mask]
+
+            return scored_pairs
+
+
+def prefilterPairs(data_model, classifier, threshold, ids, records):
+    '''
+    Drop the record pairs that cannot score above the threshold, before
+    running the expensive comparators on them.
+
+    Only the cheap, column comparators are run. For every other field,
+    the classifier's weight is paired with the most favorable distance
+    the field's comparator could return, which gives an upper bound
+    on each pair's score.
+    '''
+    weights = getattr(classifier, 'weights', None)
+    bias = getattr(classifier, 'bias', None)
+    if weights is None or bias is None or threshold <= 0 or not records:
+        return ids, records
+
+    lower, upper = data_model.distanceBounds(records)
+    weights = numpy.asarray(weights, dtype='f8')
+
+    with numpy.errstate(invalid='ignore', over='ignore'):
+        contributions = numpy.where(weights > 0,
+                                    upper * weights,
+                                    lower * weights)
+        # a zero weight times an unbounded distance
+        contributions[numpy.isnan(contributions)] = 0
+        max_scores = 1 / (1 + numpy.exp(-(contributions.sum(axis=1) + bias)))
+
+    # allow for rounding in the comparators and the distance matrix
+    keep = max_scores > threshold - 1e-4
+    if keep.all():
+        return ids, records
+
+    return (list(itertools.compress(ids, keep)),
+            list(itertools.compress(records, keep)))
+
+
+class RecordStore(object):
+    '''
+    Append only file of pickled (record_id, record) tuples.
+
+    Each record is serialized once, no matter how many blocks it is
+    in, and the scoring processes are sent arrays of record locations
+    in the file instead of the records themselves.
+
+    When linking, the two datasets can share record ids, so records
+    are keyed by their side of the pair too. When both records of
+    every pair come from the same data, pass same_data=True to key
+    records by their id alone, so a record is stored once, not once
+    for each side it appears on.
+    '''
+
+    def __init__(self, same_data=False):
+        fd, self.file_path = tempfile.mkstemp()
+        self._file = os.fdopen(fd, 'wb')
+        self._locations = {}
+        self._end = 0
+        self.same_data = same_data
+
+    def locate(self, key, record_id, record):
+        try:
+            return self._locations[key]
+        except KeyError:
+            data = pickle.dumps((record_id, record),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+            location = self._locations[key] = (self._end, len(data))
+            self._file.write(data)
+            self._end += len(data)
+            return location
+
+    def internPairs(self, record_pairs):
+        '''
+        Replace pairs of (record_id, record, smaller_ids) with the
+        locations of the two records, dropping pairs that share a
+        smaller block and so will be compared in another block
+        '''
+        locate = self.locate
+
+        if self.same_data:
+            side_1 = side_2 = 0
+        else:
+            side_1, side_2 = 0, 1
+
+        for record_pair in record_pairs:
+            ((id_1, record_1, smaller_ids_1),
+             (id_2, record_2, smaller_ids_2)) = record_pair
 
-                temp_file, file_path = tempfile.mkstemp()
-                os.close(temp_file)
+            if smaller_ids_1.isdisjoint(smaller_ids_2):
+                yield (locate((side_1, id_1), id_1, record_1) +
+                       locate((side_2, id_2), id_2, record_2))
+
+    def pack(self, chunk):
+        # make sure that every record in the chunk can be read by
+        # the scoring processes before we hand the chunk to them
+        self._file.flush()
+        return numpy.array(chunk, dtype='u8')
+
+    def close(self):
+        self._file.close()
+        os.remove(self.file_path)
+
+
+class RecordReader(object):
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._buffer = b''
+
+    def read(self, offset, length):
+        end = offset + length
+        if end > len(self._buffer):
+            # the store has grown since we last mapped it
+            self.close()
+            with open(self.file_path, 'rb') as f:
+                self._buffer = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+
+        return pickle.loads(self._buffer[offset:end])
+
+    def close(self):
+        # the store can't be removed on Windows while it is still mapped
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b''
+
+
+class ScoredPairsFile(object):
+    '''
+    Growable file of scored pairs. Chunks of scored pairs are appended
+    to the end of the file as they arrive from the scoring processes,
+    so every score is written to disk exactly once.
+    '''
+
+    def __init__(self):
+        fd, self.file_path = tempfile.mkstemp()
+        self._file = os.fdopen(fd, 'wb')
+        self.dtype = None
+        self.size = 0
+
+    def append(self, scored_pairs):
+        if self.dtype is None:
+            self.dtype = scored_pairs.dtype
+        else:
+            scored_pairs = scored_pairs.astype(self.dtype, copy=False)
 
-                scored_pairs = numpy.memmap(file_path,
-                                            shape=numpy.count_nonzero(mask),
-                                            dtype=dtype)
+        self._file.write(scored_pairs.data)
+        self.size += len(scored_pairs)
 
-                scored_pairs['pairs'] = ids[mask]
-                scored_pairs['score'] = scores[mask]
+    def close(self):
+        self._file.close()
 
-                return file_path, dtype
+    def remove(self):
+        self.close()
+        os.remove(self.file_path)
 
 
 def mergeScores(score_queue, result_queue, stop_signals):
-    scored_pairs_file, file_path = tempfile.mkstemp()
-    os.close(scored_pairs_file)
+    scored_pairs_file = ScoredPairsFile()
 
     seen_signals = 0
-    end = 0
 
     while seen_signals < stop_signals:
 
         score_chunk = score_queue.get()
 
         if isinstance(score_chunk, Exception):
+            scored_pairs_file.remove()
             result_queue.put(score_chunk)
-            raise
+            raise score_chunk
         elif score_chunk is None:
             seen_signals += 1
         else:
-            score_file, dtype = score_chunk
-            score_chunk = numpy.memmap(score_file, mode='r', dtype=dtype)
+            scored_pairs_file.append(score_chunk)
 
-            chunk_size = len(score_chunk)
+    if scored_pairs_file.size:
+        scored_pairs_file.close()
+        result_queue.put((scored_pairs_file.file_path,
+                          scored_pairs_file.dtype,
+                          scored_pairs_file.size))
+    else:
+        scored_pairs_file.remove()
+        result_queue.put(None)
 
-            fp = numpy.memmap(file_path, dtype=dtype,
-                              offset=(end * dtype.itemsize),
-                              shape=(chunk_size, ))
 
-            fp[:chunk_size] = score_chunk
+def scoreDuplicates(records, data_model, classifier, num_cores=1, threshold=0,
+                    intern_records=False, id_type=None, chunk_sizer=None,
+                    pool=None, backend='process', prefilter=False,
+                    same_data=False):
+    first, records = peek(records)
+    if first is None:
+        raise BlockingError("No records have been blocked together. "
+                            "Is the data you are trying to match like "
+                            "the data you trained on?")
 
-            end += chunk_size
+    if pool is None and backend != 'process':
+        with ScoringPool(max(num_cores, 1), data_model, classifier,
+                         backend) as pool:
+            return scoreDuplicates(records, data_model, classifier,
+                                   num_cores, threshold, intern_records,
+                                   id_type, chunk_sizer, pool,
+                                   prefilter=prefilter,
+                                   same_data=same_data)
+
+    if intern_records:
+        record_store = RecordStore(same_data)
+        records = record_store.internPairs(records)
+        pack = record_store.pack
+        store_path = record_store.file_path
+    else:
+        record_store = None
+        pack = None
+        store_path = None
 
-            del score_chunk
-            os.remove(score_file)
+    try:
+        if pool is None:
+            result = _scoreDuplicates(records, data_model, classifier,
+                                      num_cores, threshold, store_path, pack,
+                                      id_type, chunk_sizer, prefilter)
+        else:
+            result = pool.scoreDuplicates(records, threshold, store_path,
+                                          pack, id_type, chunk_sizer,
+                                          prefilter)
+    finally:
+        if record_store is not None:
+            record_store.close()
 
-    if end:
-        result_queue.put((file_path, dtype, end))
+    if result:
+        scored_pairs_file, dtype, size = result
+        scored_pairs = numpy.memmap(scored_pairs_file,
+                                    dtype=dtype,
+                                    shape=(size,))
     else:
-        result_queue.put(None)
+        dtype = numpy.dtype([('pairs', object, 2),
+                             ('score', 'f4', 1)])
+        scored_pairs = numpy.array([], dtype=dtype)
+
+    return scored_pairs
 
 
-def scoreDuplicates(records, data_model, classifier, num_cores=1, threshold=0):
+def _scoreDuplicates(records, data_model, classifier, num_cores, threshold,
+                     store_path, pack, id_type, chunk_sizer, prefilter):
     if num_cores < 2:
         from multiprocessing.dummy import Process, Queue
         SimpleQueue = Queue
     else:
         from .backport import Process, SimpleQueue, Queue
 
-    first, records = peek(records)
-    if first is None:
-        raise BlockingError("No records have been blocked together. "
-                            "Is the data you are trying to match like "
-                            "the data you trained on?")
-
     record_pairs_queue = Queue(2)
     score_queue = SimpleQueue()
     result_queue = SimpleQueue()
 
     n_map_processes = max(num_cores, 1)
-    score_records = ScoreDupes(data_model, classifier, threshold)
+    score_records = ScoreDupes(data_model, classifier, threshold, store_path,
+                               id_type, prefilter)
     map_processes = [Process(target=score_records,
                              args=(record_pairs_queue,
                                    score_queue))
@@ -220,66 +459,57 @@ def scoreDuplicates(records, data_model, classifier, num_cores=1, threshold=0):
                                    n_map_processes))
     reduce_process.start()
 
-    fillQueue(record_pairs_queue, records, n_map_processes)
+    try:
+        fillQueue(record_pairs_queue, records, n_map_processes, pack,
+                  chunk_sizer)
 
-    result = result_queue.get()
-    if isinstance(result, Exception):
-        raise ChildProcessError
+        result = result_queue.get()
+        if isinstance(result, Exception):
+            raise ChildProcessError
 
-    if result:
-        scored_pairs_file, dtype, size = result
-        scored_pairs = numpy.memmap(scored_pairs_file,
-                                    dtype=dtype,
-                                    shape=(size,))
-    else:
-        dtype = numpy.dtype([('pairs', object, 2),
-                             ('score', 'f4', 1)])
-        scored_pairs = numpy.array([], dtype=dtype)
+        reduce_process.join()
+        [process.join() for process in map_processes]
+    finally:
+        # when the scorers are threads, they share this reader of the
+        # record store, which has to be closed before the store is removed
+        score_records.close()
 
-    reduce_process.join()
-    [process.join() for process in map_processes]
+    return result
 
-    return scored_pairs
 
+def internIds(record_pairs, id_index):
+    '''
+    Replace the record ids in pairs of (record_id, record, smaller_ids)
+    with dense integers, assigned by the id_index Enumerator in the
+    order that records are first seen. Once the pairs have been
+    consumed, list(id_index) maps the integers back to record ids.
+    '''
+    for record_pair in record_pairs:
+        ((id_1, record_1, smaller_ids_1),
+         (id_2, record_2, smaller_ids_2)) = record_pair
+
+        yield ((id_index[id_1], record_1, smaller_ids_1),
+               (id_index[id_2], record_2, smaller_ids_2))
 
-def fillQueue(queue, iterable, stop_signals):
+
+def fillQueue(queue, iterable, stop_signals, pack=None, chunk_sizer=None):
     iterable = iter(iterable)
-    chunk_size = 10000
-    upper_bound = 7000000  # this number worked, but is unprincipled
-    multiplier = 1.1
 
-    # initial values
-    i = 0
-    n_records = 0
-    t0 = time.perf_counter()
-    last_rate = 10000
+    if chunk_sizer is None:
+        chunk_sizer = ChunkSizer()
+    chunk_sizer.start()
 
     while True:
-        chunk = tuple(itertools.islice(iterable, int(chunk_size)))
+        chunk = tuple(itertools.islice(iterable, chunk_sizer.chunk_size))
         if chunk:
-            queue.put(chunk)
-            del chunk
-
-            n_records += chunk_size
-            i += 1
-
-            if i % 10:
-                time_delta = max(time.perf_counter() - t0, 0.0001)
+            if pack is not None:
+                chunk = pack(chunk)
 
-                current_rate = n_records / time_delta
-
-                # chunk_size is always either growing or shrinking, if
-                # the shrinking led to a faster rate, keep
-                # shrinking. Same with growing. If the rate decreased,
-                # reverse directions
-                if current_rate < last_rate:
-                    multiplier = 1 / multiplier
-
-                chunk_size = min(max(chunk_size * multiplier, 1), upper_bound)
+            t0 = time.perf_counter()
+            queue.put(chunk)
+            chunk_sizer.update(chunk, time.perf_counter() - t0)
 
-                last_rate = current_rate
-                n_records = 0
-                t0 = time.perf_counter()
+            del chunk
 
         else:
             # put poison pills in queue to tell scorers that they are
@@ -288,29 +518,151 @@ def fillQueue(queue, iterable, stop_signals):
             break
 
 
+class ChunkSizer(object):
+    '''
+    Decides how many record pairs go into each chunk that fillQueue
+    sends to the scoring processes.
+
+    Every `retune_every` chunks, the rate at which the scorers took
+    pairs off the queue is compared to the rate from the last
+    retuning. The chunk size keeps growing (or shrinking) while that
+    rate improves, and reverses direction when it drops. The chunk size
+    is capped so that a chunk holds at most `max_chunk_bytes` of
+    serialized pairs, estimated from a sample of each retuned chunk.
+
+    If `stats_callback` is given, it is called after every retuning
+    with a dictionary of the chunk size, the rate in pairs per second,
+    the fraction of time spent waiting for room on the queue and the
+    estimated bytes per pair.
+    '''
+
+    def __init__(self, chunk_size=10000, max_chunk_bytes=256 * 1024 ** 2,
+                 multiplier=1.1, retune_every=10, stats_callback=None):
+        self._chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.multiplier = multiplier
+        self.retune_every = retune_every
+        self.stats_callback = stats_callback
+
+        self.bytes_per_pair = None
+        self.last_rate = None
+
+    @property
+    def chunk_size(self):
+        return int(self._chunk_size)
+
+    def start(self):
+        self.last_rate = None
+        self._n_chunks = 0
+        self._n_pairs = 0
+        self._queue_wait = 0.0
+        self._t0 = time.perf_counter()
+
+    def update(self, chunk, queue_wait):
+        self._n_chunks += 1
+        self._n_pairs += len(chunk)
+        self._queue_wait += queue_wait
+
+        if self.bytes_per_pair is None:
+            self.bytes_per_pair = self._bytesPerPair(chunk)
+            self._cap()
+
+        if self._n_chunks % self.retune_every == 0:
+            self._retune(chunk)
+
+    def _retune(self, chunk):
+        time_delta = max(time.perf_counter() - self._t0, 0.0001)
+        current_rate = self._n_pairs / time_delta
+
+        # chunk_size is always either growing or shrinking, if
+        # the shrinking led to a faster rate, keep
+        # shrinking. Same with growing. If the rate decreased,
+        # reverse directions
+        if self.last_rate is not None and current_rate < self.last_rate:
+            self.multiplier = 1 / self.multiplier
+
+        self.bytes_per_pair = self._bytesPerPair(chunk)
+        self._chunk_size = max(self._chunk_size * self.multiplier, 1)
+        self._cap()
+
+        if self.stats_callback is not None:
+            self.stats_callback({'chunk_size': self.chunk_size,
+                                 'rate': current_rate,
+                                 'queue_wait': self._queue_wait / time_delta,
+                                 'bytes_per_pair': self.bytes_per_pair})
+
+        self.last_rate = current_rate
+        self._n_pairs = 0
+        self._queue_wait = 0.0
+        self._t0 = time.perf_counter()
+
+    def _cap(self):
+        max_pairs = max(self.max_chunk_bytes // self.bytes_per_pair, 1)
+        self._chunk_size = min(self._chunk_size, max_pairs)
+
+    @staticmethod
+    def _bytesPerPair(chunk, sample_size=100):
+        if isinstance(chunk, numpy.ndarray):
+            return chunk.itemsize * chunk[0].size
+        sample = chunk[:sample_size]
+        return len(pickle.dumps(sample, pickle.HIGHEST_PROTOCOL)) / len(sample)
+
+
 class ScoreGazette(object):
-    def __init__(self, data_model, classifier, threshold):
+    def __init__(self, data_model, classifier, threshold, n_matches=None,
+                 chunk_size=10000, prefilter=False):
         self.data_model = data_model
         self.classifier = classifier
         self.threshold = threshold
+        self.n_matches = n_matches
+        self.chunk_size = chunk_size
+        self.prefilter = prefilter
 
     def __call__(self, block):
+        # Score the candidates for a messy record a chunk at a time,
+        # only keeping the best n_matches, so that memory stays flat
+        # even for very large blocks of canonical records
+        block = iter(block)
+        top_pairs = None
+
+        while True:
+            chunk = tuple(itertools.islice(block, self.chunk_size))
+            if not chunk:
+                break
+
+            scored_pairs = self.score(chunk)
+            if top_pairs is not None:
+                scored_pairs = numpy.concatenate((top_pairs, scored_pairs))
+
+            top_pairs = topScores(scored_pairs, self.n_matches)
+
+        return top_pairs
+
+    def score(self, record_pairs):
         ids = []
         records = []
 
-        for record_pair in block:
+        for record_pair in record_pairs:
             ((id_1, record_1, _),
              (id_2, record_2, _)) = record_pair
 
             ids.append((id_1, id_2))
             records.append((record_1, record_2))
 
-        distances = self.data_model.distances(records)
-        scores = self.classifier.predict_proba(distances)[:, -1]
+        id_type = sniff_id_type(ids)
+
+        if self.prefilter:
+            ids, records = prefilterPairs(self.data_model, self.classifier,
+                                          self.threshold, ids, records)
+
+        if records:
+            distances = self.data_model.distances(records)
+            scores = self.classifier.predict_proba(distances)[:, -1]
+        else:
+            scores = numpy.empty(0)
 
         mask = scores > self.threshold
-        id_type = sniff_id_type(ids)
-        ids = numpy.array(ids, dtype=id_type)
+        ids = numpy.array(ids, dtype=id_type).reshape(-1, 2)
 
         dtype = numpy.dtype([('pairs', id_type, 2),
                              ('score', 'f4')])
@@ -324,15 +676,46 @@ class ScoreGazette(object):
         return scored_pairs
 
 
-def scoreGazette(records, data_model, classifier, num_cores=1, threshold=0):
+def topScores(scored_pairs, n):
+    '''
+    Return the scored pairs whose score is among the n highest, without
+    sorting. Every pair tied with the nth highest score is kept, so
+    sorting the result and taking the first n gives the same pairs as
+    sorting all of them.
+    '''
+    if n and len(scored_pairs) > n:
+        nth_score = numpy.partition(scored_pairs['score'], -n)[-n]
+        scored_pairs = scored_pairs[scored_pairs['score'] >= nth_score]
+
+    return scored_pairs
+
+
+def scoreGazette(records, data_model, classifier, num_cores=1, threshold=0,
+                 n_matches=None, pool=None, backend='process',
+                 prefilter=False):
 
     first, records = peek(records)
     if first is None:
         raise ValueError("No records to match")
 
+    if pool is None and backend != 'process':
+        with ScoringPool(max(num_cores, 1), data_model, classifier,
+                         backend) as pool:
+            for scored_pairs in pool.imapGazette(records, threshold,
+                                                 n_matches, prefilter):
+                yield scored_pairs
+        return
+
+    if pool is not None:
+        for scored_pairs in pool.imapGazette(records, threshold, n_matches,
+                                             prefilter):
+            yield scored_pairs
+        return
+
     imap, pool = appropriate_imap(num_cores)
 
-    score_records = ScoreGazette(data_model, classifier, threshold)
+    score_records = ScoreGazette(data_model, classifier, threshold, n_matches,
+                                 prefilter=prefilter)
 
     for scored_pairs in imap(score_records, records):
         yield scored_pairs
@@ -344,6 +727,200 @@ def scoreGazette(records, data_model, classifier, num_cores=1, threshold=0):
     pool.join()
 
 
+class ScoringPool(object):
+    '''
+    Pool of scoring workers that is sent the data model and classifier
+    once, when it starts, and that can then be reused across many calls
+    to scoreDuplicates and scoreGazette. Only the record pairs and the
+    per-call settings are sent with each task.
+
+    The backend can be 'process', 'thread' or 'serial'. Threads avoid
+    pickling the record pairs, and are the better choice when most of
+    the time is spent in comparators that release the GIL. The
+    'process' backend falls back to threads where dedupe does not
+    support multiprocessing.
+
+    Call close(), or use the pool as a context manager, to shut the
+    workers down.
+    '''
+
+    def __init__(self, num_cores, data_model, classifier, backend='process'):
+        from .backport import Pool
+
+        self.num_cores = num_cores
+        self._token = id(self)
+
+        initargs = (self._token, data_model, classifier)
+
+        if backend == 'serial':
+            self._pool = SerialPool(_initScorer, initargs)
+        elif backend == 'thread':
+            from multiprocessing.dummy import Pool as ThreadPool
+            self._pool = ThreadPool(num_cores, _initScorer, initargs)
+        elif backend == 'process':
+            self._pool = Pool(num_cores, _initScorer, initargs)
+        else:
+            raise ValueError("backend must be one of 'process', "
+                             "'thread' or 'serial', not %r" % backend)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            _scorers.pop(self._token, None)
+
+    def imapGazette(self, records, threshold, n_matches, prefilter=False):
+        tasks = ((self._token, threshold, n_matches, prefilter, block)
+                 for block in records)
+
+        for result in self._submitAll(_scoreGazetteBlock, tasks):
+            yield result.get()
+
+    def scoreDuplicates(self, records, threshold, store_path, pack, id_type,
+                        chunk_sizer, prefilter=False):
+        records = iter(records)
+
+        if chunk_sizer is None:
+            chunk_sizer = ChunkSizer()
+        chunk_sizer.start()
+
+        def tasks():
+            while True:
+                chunk = tuple(itertools.islice(records,
+                                               chunk_sizer.chunk_size))
+                if not chunk:
+                    break
+                if pack is not None:
+                    chunk = pack(chunk)
+
+                yield (self._token, threshold, store_path, id_type, prefilter,
+                       chunk)
+
+        scored_pairs_file = ScoredPairsFile()
+
+        try:
+            for result in self._submitAll(_scoreDupesChunk, tasks(),
+                                          chunk_sizer):
+                scored_pairs = result.get()
+                if scored_pairs is not None:
+                    scored_pairs_file.append(scored_pairs)
+        except Exception:
+            scored_pairs_file.remove()
+            raise
+
+        if scored_pairs_file.size:
+            scored_pairs_file.close()
+            return (scored_pairs_file.file_path,
+                    scored_pairs_file.dtype,
+                    scored_pairs_file.size)
+        else:
+            scored_pairs_file.remove()
+            return None
+
+    def _submitAll(self, fn, tasks, chunk_sizer=None):
+        '''
+        Submit tasks and yield their async results in order. A couple of
+        tasks per worker are kept in flight, so workers don't wait on
+        us, without reading all the tasks into memory.
+        '''
+        pending = collections.deque()
+        max_pending = 2 * self.num_cores
+
+        for task in tasks:
+            pending.append(self._pool.apply_async(fn, (task,)))
+
+            t0 = time.perf_counter()
+            while len(pending) >= max_pending:
+                result = pending.popleft()
+                result.wait()
+                yield result
+
+            if chunk_sizer is not None:
+                chunk_sizer.update(task[-1], time.perf_counter() - t0)
+
+        while pending:
+            yield pending.popleft()
+
+
+class SerialPool(object):
+    '''
+    Runs each task as soon as it is submitted, in the calling thread,
+    with the parts of the multiprocessing.Pool interface that
+    ScoringPool uses
+    '''
+
+    def __init__(self, initializer, initargs):
+        initializer(*initargs)
+
+    def apply_async(self, fn, args=()):
+        try:
+            return SerialResult(fn(*args))
+        except Exception as e:
+            return SerialResult(exception=e)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class SerialResult(object):
+    def __init__(self, value=None, exception=None):
+        self._value = value
+        self._exception = exception
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+
+# the data models and classifiers of the ScoringPools that this
+# process is working for
+_scorers = {}
+
+
+def _initScorer(token, data_model, classifier):
+    _scorers[token] = (data_model, classifier)
+
+
+def _scoreGazetteBlock(task):
+    token, threshold, n_matches, prefilter, block = task
+    data_model, classifier = _scorers[token]
+
+    score_records = ScoreGazette(data_model, classifier, threshold, n_matches,
+                                 prefilter=prefilter)
+
+    return score_records(block)
+
+
+def _scoreDupesChunk(task):
+    token, threshold, store_path, id_type, prefilter, chunk = task
+    data_model, classifier = _scorers[token]
+
+    score_records = ScoreDupes(data_model, classifier, threshold, store_path,
+                               id_type, prefilter)
+
+    if store_path is None:
+        return score_records.fieldDistance(chunk)
+
+    try:
+        return score_records.storedFieldDistance(chunk)
+    finally:
+        score_records.close()
+
+
 def appropriate_imap(num_cores):
     if num_cores < 2:
         imap = map
@@ -395,10 +972,102 @@ def index(data, offset=0):
         return data
 
 
+def externalSort(iterable, buffer_size, key=None):
+    '''
+    Sort an iterable that may not fit in memory. At most buffer_size
+    items are held in memory at once; they are sorted and written to
+    temporary files as sorted runs, which are merged lazily.
+
+    The iterable is fully consumed before this returns, and the
+    temporary files are removed once the merged items are consumed.
+    '''
+    iterable = iter(iterable)
+    runs = []
+
+    try:
+        while True:
+            buffer = list(itertools.islice(iterable, buffer_size))
+            if not buffer:
+                break
+            buffer.sort(key=key)
+
+            run = tempfile.TemporaryFile()
+            pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+            for item in buffer:
+                pickler.dump(item)
+                # the pickler would otherwise keep every item alive
+                pickler.clear_memo()
+            run.seek(0)
+            runs.append(run)
+
+            del buffer
+    except BaseException:
+        for run in runs:
+            run.close()
+        raise
+
+    return _mergeRuns(runs, key)
+
+
+def _mergeRuns(runs, key):
+    def readRun(run):
+        unpickler = pickle.Unpickler(run)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+
+    try:
+        for item in heapq.merge(*(readRun(run) for run in runs), key=key):
+            yield item
+    finally:
+        for run in runs:
+            run.close()
+
+
 def Enumerator(start=0, initial=()):
     return collections.defaultdict(itertools.count(start).__next__, initial)
 
 
+class SmallerBlocks(object):
+    '''
+    Stands in for the set of smaller block keys that a record is
+    covered by, for a record in the block with id `block_id`.
+
+    `block_ids` is the sorted array of the ids of every block the
+    record is in. That array is shared by all of the record's blocks,
+    so each block only adds this small object, instead of a new set of
+    block keys.
+    '''
+    __slots__ = ('block_ids', 'block_id')
+
+    def __init__(self, block_ids, block_id):
+        self.block_ids = block_ids
+        self.block_id = block_id
+
+    def __iter__(self):
+        return itertools.takewhile(lambda k: k < self.block_id,
+                                   self.block_ids)
+
+    def isdisjoint(self, other):
+        if not isinstance(other, SmallerBlocks):
+            return set(self).isdisjoint(other)
+
+        # Both records are in this block, so the first block they have
+        # in common is this one, unless they share a smaller block
+        block_ids_1, block_ids_2 = self.block_ids, other.block_ids
+        i = j = 0
+        while True:
+            block_id_1, block_id_2 = block_ids_1[i], block_ids_2[j]
+            if block_id_1 == block_id_2:
+                return block_id_1 == self.block_id
+            elif block_id_1 < block_id_2:
+                i += 1
+            else:
+                j += 1
+
+
 def sniff_id_type(ids):
     example = ids[0][0]
     python_type = type(example)
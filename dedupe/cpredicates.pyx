@@ -1,5 +1,13 @@
 # cython: c_string_type=unicode, c_string_encoding=utf8, infertypes=True, language_level=3
 
+from libc.stdint cimport uint64_t
+from libc.stdlib cimport malloc, free, qsort
+
+cdef extern from "Python.h":
+    int PyUnicode_4BYTE_KIND
+    unicode PyUnicode_FromKindAndData(int kind, const void *buffer,
+                                      Py_ssize_t size)
+
 cpdef list ngrams(basestring field, int n):
     """ngrams returns all unique, contiguous sequences of n characters
     of a given field.
@@ -42,6 +50,113 @@ cpdef tuple initials(basestring field, int n):
 
     return (ufield[:n], )
 
+cpdef tuple charBlockKeys(basestring field):
+    """charBlockKeys computes the block keys of all the character level
+    predicates of a field in one pass over the field with its spaces
+    removed. They are returned grouped by predicate, in the order
+
+        (field without spaces,
+         oneGramFingerprint, twoGramFingerprint,
+         commonFourGram, commonSixGram,
+         sameThreeCharStartPredicate, sameFiveCharStartPredicate,
+         sameSevenCharStartPredicate)
+
+    with the n-grams as frozensets, since the groups may be shared
+    between the predicates that use them.
+
+    usage:
+    >>> charBlockKeys("de dupe")[3]
+    frozenset({'dedu', 'edup', 'dupe'})
+    """
+    cdef unicode ufield = _ustring(field)
+    cdef unicode chars = ufield.replace(' ', '')
+    cdef Py_ssize_t n_char = len(chars)
+
+    cdef list fourgrams = []
+    cdef list sixgrams = []
+    cdef Py_ssize_t i
+    for i in range(n_char - 3):
+        fourgrams.append(chars[i:i + 4])
+        if i + 6 <= n_char:
+            sixgrams.append(chars[i:i + 6])
+
+    cdef tuple two_gram_fingerprint
+    if len(ufield) <= 1:
+        two_gram_fingerprint = ()
+    elif _hasSpace(chars):
+        # the 2-grams have to be stripped before they are sorted
+        two_gram_fingerprint = (u''.join(sorted([gram.strip() for gram
+                                                 in {chars[i:i + 2] for i
+                                                     in range(n_char - 1)}])),)
+    else:
+        two_gram_fingerprint = (_fingerprint(chars, 2),)
+
+    return (chars,
+            (_fingerprint(chars, 1).strip(),),
+            two_gram_fingerprint,
+            frozenset(fourgrams),
+            frozenset(sixgrams),
+            (chars[:3],),
+            (chars[:5],),
+            (chars[:7],))
+
+
+cdef bint _hasSpace(unicode s):
+    cdef Py_UCS4 c
+    for c in s:
+        if c.isspace():
+            return True
+    return False
+
+
+cdef int _compare(const void *a, const void *b) noexcept nogil:
+    cdef uint64_t x = (<const uint64_t *>a)[0]
+    cdef uint64_t y = (<const uint64_t *>b)[0]
+    return (x > y) - (x < y)
+
+
+cdef unicode _fingerprint(unicode s, int n):
+    """The distinct n-grams of s, for n of 1 or 2, sorted and joined.
+    Each n-gram is packed into an integer, which sorts in the same
+    order as the n-gram's string, so no n-gram strings are created.
+    """
+    cdef Py_ssize_t n_char = len(s)
+    cdef Py_ssize_t n_grams = n_char - n + 1
+    if n_grams <= 0:
+        return u''
+
+    cdef uint64_t *grams = <uint64_t *>malloc(n_grams * sizeof(uint64_t))
+    cdef Py_UCS4 *chars = <Py_UCS4 *>malloc(n_grams * n * sizeof(Py_UCS4))
+    if grams is NULL or chars is NULL:
+        free(grams)
+        free(chars)
+        raise MemoryError()
+
+    cdef Py_ssize_t i, j, length = 0
+    cdef uint64_t gram
+    try:
+        for i in range(n_grams):
+            gram = 0
+            for j in range(n):
+                # code points fit in 21 bits
+                gram = (gram << 21) | <uint64_t>s[i + j]
+            grams[i] = gram
+
+        qsort(grams, n_grams, sizeof(uint64_t), _compare)
+
+        for i in range(n_grams):
+            if i and grams[i] == grams[i - 1]:
+                continue
+            gram = grams[i]
+            for j in range(n - 1, -1, -1):
+                chars[length + j] = <Py_UCS4>(gram & 0x1FFFFF)
+                gram >>= 21
+            length += n
+
+        return PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND, chars, length)
+    finally:
+        free(grams)
+        free(chars)
 
 
 cdef unicode _ustring(basestring s):
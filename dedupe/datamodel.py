@@ -1,9 +1,11 @@
 import pkgutil
+import itertools
 
 import numpy
 import copyreg
 import types
 
+import dedupe.predicates
 import dedupe.variables
 import dedupe.variables.base as base
 from dedupe.variables.base import MissingDataType
@@ -58,7 +60,10 @@ class DataModel(object):
             for predicate in definition.predicates:
                 if hasattr(predicate, 'index'):
                     if index_predicates:
-                        if hasattr(predicate, 'canopy'):
+                        if isinstance(predicate,
+                                      dedupe.predicates.SortedNeighborhoodPredicate):
+                            predicates.add(predicate)
+                        elif hasattr(predicate, 'canopy'):
                             if canopies:
                                 predicates.add(predicate)
                         else:
@@ -73,24 +78,144 @@ class DataModel(object):
         num_records = len(record_pairs)
 
         distances = numpy.empty((num_records, len(self)), 'f4')
-        field_comparators = self._field_comparators
 
-        for i, (record_1, record_2) in enumerate(record_pairs):
-
-            for field, compare, start, stop in field_comparators:
-                if record_1[field] is not None and record_2[field] is not None:
-                    distances[i, start:stop] = compare(record_1[field],
-                                                       record_2[field])
-                elif hasattr(compare, 'missing'):
-                    distances[i, start:stop] = compare(record_1[field],
-                                                       record_2[field])
-                else:
-                    distances[i, start:stop] = numpy.nan
+        # Comparators that can work on whole columns of field values
+        # fill their slice of the distance matrix in one go, the rest
+        # fall back to comparing one record pair at a time
+        field_comparators = []
+        for variable, field_comparator in zip(self.primary_fields,
+                                              self._field_comparators):
+            column_compare = getattr(variable, 'column_comparator', None)
+            if column_compare is None:
+                field_comparators.append(field_comparator)
+            else:
+                field, compare, start, stop = field_comparator
+                distances[:, start:stop] = columnDistances(record_pairs,
+                                                           field,
+                                                           compare,
+                                                           column_compare,
+                                                           stop - start)
+
+        if field_comparators:
+            for i, (record_1, record_2) in enumerate(record_pairs):
+
+                for field, compare, start, stop in field_comparators:
+                    if record_1[field] is not None and record_2[field] is not None:
+                        distances[i, start:stop] = compare(record_1[field],
+                                                           record_2[field])
+                    elif hasattr(compare, 'missing'):
+                        distances[i, start:stop] = compare(record_1[field],
+                                                           record_2[field])
+                    else:
+                        distances[i, start:stop] = numpy.nan
 
         distances = self._derivedDistances(distances)
 
         return distances
 
+    def distanceBounds(self, record_pairs):
+        '''
+        Bound the distances of record pairs without running expensive
+        comparators. Fields with a column comparator are compared
+        exactly, the distances for other fields are only bounded by
+        their `column_lower_bound` and `distance_bounds`. Returns arrays of the lower and
+        upper bounds of every variable, including derived variables.
+        '''
+        num_records = len(record_pairs)
+
+        lower = numpy.empty((num_records, len(self)), 'f4')
+        upper = numpy.empty((num_records, len(self)), 'f4')
+        maybe_nan = numpy.zeros((num_records, len(self)), bool)
+
+        for variable, (field, compare, start, stop) in zip(self.primary_fields,
+                                                           self._field_comparators):
+            column_compare = getattr(variable, 'column_comparator', None)
+            if column_compare is not None:
+                distances = columnDistances(record_pairs,
+                                            field,
+                                            compare,
+                                            column_compare,
+                                            stop - start)
+                lower[:, start:stop] = distances
+                upper[:, start:stop] = distances
+            else:
+                low, high = variable.distance_bounds
+                lower[:, start:stop] = low
+                upper[:, start:stop] = high
+
+                column_lower_bound = getattr(variable,
+                                             'column_lower_bound',
+                                             None)
+                if column_lower_bound is not None:
+                    lower[:, start:stop] = columnDistances(record_pairs,
+                                                           field,
+                                                           compare,
+                                                           column_lower_bound,
+                                                           stop - start)
+                else:
+                    # comparators may still return nan for present values
+                    maybe_nan[:, start:stop] = True
+
+                if not hasattr(compare, 'missing'):
+                    missing = numpy.fromiter((record_1[field] is None or
+                                              record_2[field] is None
+                                              for record_1, record_2
+                                              in record_pairs),
+                                             dtype=bool,
+                                             count=num_records)
+                    lower[missing, start:stop] = numpy.nan
+                    upper[missing, start:stop] = numpy.nan
+                    maybe_nan[missing, start:stop] = False
+
+        return self._derivedBounds(lower, upper, maybe_nan)
+
+    def _derivedBounds(self, lower, upper, maybe_nan):
+        # Interval arithmetic version of _derivedDistances. A nan in
+        # lower and upper means the distance is known to be missing,
+        # maybe_nan marks bounds on distances that could be missing
+        current_column = self._derived_start
+
+        with numpy.errstate(invalid='ignore'):
+            for interaction in self._interaction_indices:
+                low, high = lower[:, interaction[0]], upper[:, interaction[0]]
+                for i in interaction[1:]:
+                    # 0 * inf is nan, but the product really is 0
+                    products = numpy.array([low * lower[:, i],
+                                            low * upper[:, i],
+                                            high * lower[:, i],
+                                            high * upper[:, i]])
+                    products[numpy.isnan(products)] = 0
+                    known_missing = numpy.isnan(low) | numpy.isnan(lower[:, i])
+                    low = products.min(axis=0)
+                    high = products.max(axis=0)
+                    low[known_missing] = numpy.nan
+                    high[known_missing] = numpy.nan
+
+                lower[:, current_column] = low
+                upper[:, current_column] = high
+                maybe_nan[:, current_column] = maybe_nan[:, interaction].any(axis=1)
+
+                current_column += 1
+
+        missing_data = numpy.isnan(lower[:, :current_column])
+        maybe_missing = maybe_nan[:, :current_column]
+
+        lower[:, :current_column][missing_data] = 0
+        upper[:, :current_column][missing_data] = 0
+
+        lower[:, :current_column][maybe_missing] = numpy.minimum(
+            lower[:, :current_column][maybe_missing], 0)
+        upper[:, :current_column][maybe_missing] = numpy.maximum(
+            upper[:, :current_column][maybe_missing], 0)
+
+        if self._missing_field_indices:
+            not_missing = 1 - missing_data[:, self._missing_field_indices]
+            lower[:, current_column:] = not_missing
+            upper[:, current_column:] = not_missing
+            lower[:, current_column:][maybe_missing[:, self._missing_field_indices]] = 0
+
+        return lower, upper
+
     def _derivedDistances(self, primary_distances):
         distances = primary_distances
 
@@ -121,6 +246,35 @@ class DataModel(object):
                                  "in a record" % field)
 
 
+def columnDistances(record_pairs, field, compare, column_compare, width):
+    column_1 = [record_1[field] for record_1, _ in record_pairs]
+    column_2 = [record_2[field] for _, record_2 in record_pairs]
+    num_records = len(column_1)
+
+    if hasattr(compare, 'missing'):
+        distances = column_compare(column_1, column_2)
+        return numpy.reshape(distances, (num_records, width))
+
+    present = numpy.fromiter((value_1 is not None and value_2 is not None
+                              for value_1, value_2
+                              in zip(column_1, column_2)),
+                             dtype=bool,
+                             count=num_records)
+
+    distances = numpy.full((num_records, width), numpy.nan, 'f4')
+
+    if present.all():
+        distances[:] = numpy.reshape(column_compare(column_1, column_2),
+                                     (num_records, width))
+    elif present.any():
+        column_1 = list(itertools.compress(column_1, present))
+        column_2 = list(itertools.compress(column_2, present))
+        distances[present] = numpy.reshape(column_compare(column_1, column_2),
+                                           (len(column_1), width))
+
+    return distances
+
+
 def typifyFields(fields):
     primary_fields = []
     data_model = []
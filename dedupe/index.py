@@ -14,10 +14,25 @@ class Index(ABC):
     def unindex(self, doc):  # pragma: no cover
         pass
 
+    def unindexAll(self, docs):
+        '''
+        Remove a batch of docs, preparing the index for search once,
+        after all of them are removed
+        '''
+        for doc in docs:
+            self.unindex(doc)
+
     @abstractmethod  # pragma: no cover
     def search(self, doc, threshold=0):
         pass
 
+    def searchMany(self, docs, threshold=0):
+        '''
+        Search for a batch of docs, returning a list with the results
+        for each doc
+        '''
+        return [self.search(doc, threshold) for doc in docs]
+
     @abstractmethod
     def initSearch():  # pragma: no cover
         pass
@@ -28,5 +28,19 @@ class LevenshteinIndex(Index):
         else:
             return []
 
+    def searchMany(self, docs, threshold=0):
+        lookup = Levenshtein_search.lookup
+        index_key = self.index_key
+        doc_to_id = self._doc_to_id
+
+        results = {}
+        for doc in docs:
+            if doc not in results:
+                matching_docs = lookup(index_key, doc, threshold)
+                results[doc] = [doc_to_id[match]
+                                for match, _, _ in matching_docs or ()]
+
+        return [results[doc] for doc in docs]
+
     def __del__(self):
         Levenshtein_search.clear_wordset(self.index_key)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import zlib
+
+import numpy
+
+from .index import Index
+from .core import Enumerator
+
+# the largest prime below 2 ** 32, so that (a * h + b) % PRIME can't
+# overflow 64 bits for a, b and h below it
+PRIME = 4294967291
+
+
+class MinHashLSH(Index):
+    '''
+    Approximate Jaccard similarity search with MinHash signatures and
+    locality sensitive hashing. A doc is an iterable of tokens.
+
+    A search for docs with a Jaccard similarity of at least threshold
+    looks up the docs that share a band of signature rows with the
+    query, and keeps the ones whose signatures estimate a similarity of
+    at least threshold. The number of bands and of rows per band is
+    chosen for each threshold to balance false positives and false
+    negatives, unless bands and rows are given.
+    '''
+
+    def __init__(self, num_perm=128, bands=None, rows=None, seed=1):
+        if (bands is None) != (rows is None):
+            raise ValueError("Give both of bands and rows, or neither")
+        if bands is not None and bands * rows > num_perm:
+            raise ValueError("bands * rows can be at most num_perm")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = rows
+
+        random_state = numpy.random.RandomState(seed)
+        self._a = random_state.randint(1, PRIME, num_perm).astype(numpy.uint64)
+        self._b = random_state.randint(0, PRIME, num_perm).astype(numpy.uint64)
+
+        # doc id -> signature
+        self._index = {}
+        self._doc_to_id = Enumerator(start=1)
+
+        # (bands, rows) -> a dict for each band, from the band's rows of
+        # a signature to the ids of the docs with that signature
+        self._tables = {}
+        self._params = {}
+
+    def signature(self, doc):
+        if isinstance(doc, str):
+            doc = (doc,)
+        hashes = numpy.array([zlib.crc32(str(token).encode('utf-8'))
+                              for token in set(doc)],
+                             dtype=numpy.uint64) % PRIME
+        if not len(hashes):
+            return None
+
+        hashes = (numpy.outer(self._a, hashes) +
+                  self._b[:, numpy.newaxis]) % PRIME
+        return hashes.min(axis=1).astype(numpy.uint32)
+
+    def index(self, doc):
+        if doc not in self._doc_to_id:
+            doc_id = self._doc_to_id[doc]
+            signature = self.signature(doc)
+            if signature is not None:
+                self._index[doc_id] = signature
+                for (bands, rows), tables in self._tables.items():
+                    for table, key in zip(tables,
+                                          _bandKeys(signature, bands, rows)):
+                        table.setdefault(key, set()).add(doc_id)
+
+    def unindex(self, doc):
+        doc_id = self._doc_to_id.pop(doc)
+        signature = self._index.pop(doc_id, None)
+        if signature is not None:
+            for (bands, rows), tables in self._tables.items():
+                for table, key in zip(tables,
+                                      _bandKeys(signature, bands, rows)):
+                    table[key].discard(doc_id)
+                    if not table[key]:
+                        del table[key]
+
+    def initSearch(self):
+        pass
+
+    def search(self, doc, threshold=0):
+        signature = self.signature(doc)
+        if signature is None:
+            return []
+
+        bands, rows = self._bandsRows(threshold)
+        tables = self._bandTables(bands, rows)
+
+        candidates = set()
+        for table, key in zip(tables, _bandKeys(signature, bands, rows)):
+            candidates.update(table.get(key, ()))
+
+        if not candidates:
+            return []
+
+        candidates = sorted(candidates)
+        signatures = numpy.array([self._index[doc_id]
+                                  for doc_id in candidates])
+        similarity = (signatures == signature).mean(axis=1)
+
+        order = numpy.argsort(-similarity, kind='stable')
+        return [candidates[i] for i in order
+                if similarity[i] >= threshold]
+
+    def _bandsRows(self, threshold):
+        if self.bands is not None:
+            return self.bands, self.rows
+
+        if threshold not in self._params:
+            self._params[threshold] = optimalBandsRows(threshold,
+                                                       self.num_perm)
+        return self._params[threshold]
+
+    def _bandTables(self, bands, rows):
+        if (bands, rows) not in self._tables:
+            tables = [{} for _ in range(bands)]
+            for doc_id, signature in self._index.items():
+                for table, key in zip(tables,
+                                      _bandKeys(signature, bands, rows)):
+                    table.setdefault(key, set()).add(doc_id)
+            self._tables[(bands, rows)] = tables
+
+        return self._tables[(bands, rows)]
+
+    def __getstate__(self):
+        # the band tables are rebuilt from the signatures when needed
+        odict = self.__dict__.copy()
+        odict['_tables'] = {}
+        return odict
+
+
+def _bandKeys(signature, bands, rows):
+    return [signature[i * rows:(i + 1) * rows].tobytes()
+            for i in range(bands)]
+
+
+def optimalBandsRows(threshold, num_perm, false_positive_weight=0.5):
+    '''
+    The number of bands and rows per band, with bands * rows at most
+    num_perm, that minimize the weighted sum of the probabilities of
+    a false positive, for docs with a Jaccard similarity below
+    threshold, and of a false negative, for docs at or above it
+    '''
+    similarity = numpy.linspace(0, 1, 201)
+    below = similarity < threshold
+
+    best, best_error = None, float('inf')
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            # the chance that two docs share at least one band
+            candidate = 1 - (1 - similarity ** rows) ** bands
+            false_positive = _integrate(candidate * below, similarity)
+            false_negative = _integrate((1 - candidate) * ~below,
+                                        similarity)
+            error = (false_positive_weight * false_positive +
+                     (1 - false_positive_weight) * false_negative)
+            if error < best_error:
+                best, best_error = (bands, rows), error
+
+    return best
+
+
+def _integrate(y, x):
+    '''
+    The trapezoidal rule, which numpy has renamed from trapz to
+    trapezoid
+    '''
+    return numpy.sum((y[1:] + y[:-1]) * numpy.diff(x)) / 2
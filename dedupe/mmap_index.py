@@ -0,0 +1,456 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+An on-disk format for fitted TF-IDF indices and canopies, made of
+numpy arrays that are memory-mapped when they are loaded, so that
+loading is fast however large the index is, and processes that load
+the same index share its pages.
+
+An index is a directory of .npy files:
+
+- `terms.npy`: sorted hashes of the index's terms, stop words removed
+- `idf.npy`: the idf weight of each term
+- `indptr.npy`: term i's postings are `indptr[i]:indptr[i + 1]`
+- `postings.npy`: the doc ids of the postings, term by term
+- `weights.npy`: the weight of the term in the doc of each posting
+- `docs.npy` and `doc_ids.npy`: sorted hashes of the indexed docs and
+  their ids
+- `terms_offsets.npy`, `terms_strings.npy`, `docs_offsets.npy` and
+  `docs_strings.npy`: the utf-8 encoded terms and docs, in the order
+  of their hashes. String i is `strings[offsets[i]:offsets[i + 1]]`.
+
+Terms and docs are looked up by their 64 bit `blocking.hashKey`, and
+a hit is only a match if the strings are equal too, since a collision
+would otherwise search the postings of the wrong term.
+'''
+import collections
+import math
+import os
+
+import numpy
+
+from . import tfidf
+from .blocking import hashKey
+from .index import Index
+
+
+def writeIndex(index, directory):
+    '''
+    Write a TfIdfIndex or CsrTfIdfIndex, which search has been
+    initialized for, to directory, and return the memory-mapped copy
+    of it
+    '''
+    os.makedirs(directory, exist_ok=True)
+
+    if isinstance(index, tfidf.CsrTfIdfIndex):
+        terms = _csrTerms(index._index)
+    else:
+        terms = _canopyTerms(index._index)
+    terms.sort(key=lambda term: hashKey(term[0]))
+
+    indptr = numpy.zeros(len(terms) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(postings) for _, _, postings, _ in terms],
+                 out=indptr[1:])
+
+    _saveStrings(directory, 'terms', [term for term, _, _, _ in terms])
+    _save(directory, 'idf',
+          numpy.array([idf for _, idf, _, _ in terms], dtype=numpy.float64))
+    _save(directory, 'indptr', indptr)
+    _save(directory, 'postings',
+          _concatenate([postings for _, _, postings, _ in terms],
+                       numpy.int64))
+    _save(directory, 'weights',
+          _concatenate([weights for _, _, _, weights in terms],
+                       numpy.float32))
+
+    docs = sorted(((docString(doc), doc_id)
+                   for doc, doc_id in index._doc_to_id.items()),
+                  key=lambda doc: hashKey(doc[0]))
+    _saveStrings(directory, 'docs', [doc for doc, _ in docs])
+    _save(directory, 'doc_ids',
+          numpy.array([doc_id for _, doc_id in docs], dtype=numpy.int64))
+
+    return MmapTfIdfIndex(directory)
+
+
+def _canopyTerms(canopy_index):
+    wordinfo = canopy_index.index._wordinfo
+
+    terms = []
+    for term, (wid, idf) in canopy_index._wids_dict.items():
+        docs = wordinfo[wid]
+        terms.append((str(term), idf,
+                      numpy.fromiter(docs.keys(), numpy.int64, len(docs)),
+                      numpy.fromiter(docs.values(), numpy.float32, len(docs))))
+    return terms
+
+
+def _csrTerms(matrix):
+    terms = []
+    for row in numpy.flatnonzero(matrix.idf):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        terms.append((str(matrix.terms[row]), matrix.idf[row],
+                      matrix.postings[start:end], matrix.weights[start:end]))
+    return terms
+
+
+def writeCanopy(canopy, path):
+    '''
+    Write the canopy of a canopy predicate, a dict from doc ids to the
+    id of the center of their canopy or None, and return the
+    memory-mapped copy of it
+    '''
+    size = max(canopy, default=0) + 1
+    centers = numpy.full(size, MmapCanopy.MISSING, dtype=numpy.int64)
+    for doc_id, center in canopy.items():
+        centers[doc_id] = MmapCanopy.NONE if center is None else center
+
+    numpy.save(path, centers)
+
+    return MmapCanopy(path)
+
+
+class IndexFile(object):
+    '''
+    What a settings file stores in place of a memory-mapped index or
+    canopy: its name within the index directory it was written to.
+    Loading it from another directory lets the index directory move
+    with the settings file.
+    '''
+
+    def __init__(self, directory, name):
+        self.directory = os.path.abspath(directory)
+        self.name = name
+
+    def path(self, directory=None):
+        if directory is None:
+            directory = self.directory
+        return os.path.join(directory, self.name)
+
+
+class MmapTfIdfIndex(Index):
+    '''
+    A TfIdfIndex, memory-mapped from a directory written by writeIndex.
+    It pickles as just the path of that directory, for passing it to
+    other processes; settings files store an IndexFile instead.
+
+    The mapped arrays are never written to. Docs that are indexed or
+    unindexed after loading are only kept in memory, and initSearch
+    recomputes the idf weights of the terms to account for them.
+    '''
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+        self._terms = _loadStrings(self.directory, 'terms')
+        self._mapped_idf = _load(self.directory, 'idf')
+        self._indptr = _load(self.directory, 'indptr')
+        self._postings = _load(self.directory, 'postings')
+        self._weights = _load(self.directory, 'weights')
+
+        self._doc_to_id = MmapDocIds(_loadStrings(self.directory, 'docs'),
+                                     _load(self.directory, 'doc_ids'))
+
+        # docs indexed after loading, by id, and the ids of mapped docs
+        # that have been unindexed
+        self._added = {}
+        self._removed = set()
+        self.initSearch()
+
+    def __getstate__(self):
+        return {'directory': self.directory}
+
+    def __setstate__(self, d):
+        self.__init__(d['directory'])
+
+    def index(self, doc):
+        if doc not in self._doc_to_id:
+            self._added[self._doc_to_id[doc]] = doc
+
+    def unindex(self, doc):
+        self.unindexAll((doc,))
+
+    def unindexAll(self, docs):
+        for doc in docs:
+            doc_id = self._doc_to_id.pop(doc)
+            if self._added.pop(doc_id, None) is None:
+                self._removed.add(doc_id)
+        self.initSearch()
+
+    def initSearch(self):
+        self._removed_ids = numpy.array(sorted(self._removed),
+                                        dtype=numpy.int64)
+
+        # the postings of the added docs, weighted as in TermDocMatrix
+        new_postings = collections.defaultdict(list)
+        for doc_id, doc in self._added.items():
+            doc_weights = {str(term): 1.0 + math.log(count)
+                           for term, count in collections.Counter(doc).items()}
+            norm = math.sqrt(sum(weight ** 2
+                                 for weight in doc_weights.values()))
+            for term, weight in doc_weights.items():
+                new_postings[term].append((doc_id, weight / norm))
+
+        self._new_postings = {
+            term: (numpy.array([doc_id for doc_id, _ in postings],
+                               dtype=numpy.int64),
+                   numpy.array([weight for _, weight in postings],
+                               dtype=numpy.float32))
+            for term, postings in new_postings.items()}
+
+        if not self._added and not self._removed:
+            self._idf = self._mapped_idf
+            self._new_idf = {}
+            return
+
+        doc_freqs = numpy.diff(self._indptr)
+        if len(self._removed_ids):
+            removed = numpy.flatnonzero(numpy.isin(self._postings,
+                                                   self._removed_ids))
+            rows = numpy.searchsorted(self._indptr, removed,
+                                      side='right') - 1
+            doc_freqs -= numpy.bincount(rows, minlength=len(doc_freqs))
+
+        new_doc_freqs = {}
+        for term, (doc_ids, _) in self._new_postings.items():
+            row = self._terms.find(term)
+            if row >= 0:
+                doc_freqs[row] += len(doc_ids)
+            else:
+                new_doc_freqs[term] = len(doc_ids)
+
+        n_docs = len(self._doc_to_id)
+        max_doc_freq = int(max(1000, n_docs * 0.05))
+
+        live = (doc_freqs > 0) & (doc_freqs <= max_doc_freq)
+        self._idf = numpy.zeros(len(doc_freqs), dtype=numpy.float64)
+        self._idf[live] = numpy.log1p(n_docs / doc_freqs[live])
+
+        self._new_idf = {term: math.log1p(n_docs / doc_freq)
+                         for term, doc_freq in new_doc_freqs.items()
+                         if doc_freq <= max_doc_freq}
+
+    def search(self, doc, threshold=0):
+        # the same scores as CanopyIndex.apply, where every occurrence
+        # of a term in the query counts
+        if isinstance(doc, str):
+            doc = (doc,)
+
+        idf = []
+        doc_ids = []
+        weights = []
+        for term in doc:
+            term_doc_ids, term_weights, term_idf = self._postingsOf(str(term))
+            if term_idf > 0:
+                idf.append(term_idf)
+                doc_ids.append(term_doc_ids)
+                weights.append(term_weights * term_idf)
+
+        if not idf:
+            return []
+
+        idf = numpy.array(idf)
+        doc_ids = _concatenate(doc_ids, numpy.int64)
+        weights = numpy.concatenate(weights)
+
+        if len(self._removed_ids):
+            keep = ~numpy.isin(doc_ids, self._removed_ids)
+            doc_ids, weights = doc_ids[keep], weights[keep]
+
+        doc_ids, inverse = numpy.unique(doc_ids, return_inverse=True)
+        scores = numpy.bincount(inverse, weights=weights)
+
+        keep = scores >= numpy.sqrt(numpy.dot(idf, idf)) * threshold
+        doc_ids, scores = doc_ids[keep], scores[keep]
+
+        order = numpy.lexsort((doc_ids, scores))[::-1]
+
+        return doc_ids[order].tolist()
+
+    def _postingsOf(self, term):
+        '''
+        The doc ids and weights of the postings of term, both mapped
+        and added, and its idf, which is 0 for unknown and stop words
+        '''
+        row = self._terms.find(term)
+        new_doc_ids, new_weights = self._new_postings.get(term,
+                                                          _NO_POSTINGS)
+        if row < 0:
+            return new_doc_ids, new_weights, self._new_idf.get(term, 0)
+
+        start, end = self._indptr[row], self._indptr[row + 1]
+        doc_ids = self._postings[start:end]
+        weights = self._weights[start:end]
+        if len(new_doc_ids):
+            doc_ids = numpy.concatenate((doc_ids, new_doc_ids))
+            weights = numpy.concatenate((weights, new_weights))
+
+        return doc_ids, weights, self._idf[row]
+
+
+_NO_POSTINGS = (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.float32))
+
+
+class MmapDocIds(object):
+    '''
+    Stands in for the doc to id Enumerator of a TfIdfIndex. Docs that
+    were not in the index are given new ids, and docs that are popped
+    are forgotten, which is only kept in memory.
+    '''
+
+    def __init__(self, docs, doc_ids):
+        self._docs = docs
+        self._doc_ids = doc_ids
+        self._new = {}
+        self._popped = set()
+        self._next_id = int(doc_ids.max(initial=0)) + 1
+
+    def _find(self, doc):
+        if doc in self._new:
+            return self._new[doc]
+        i = self._docs.find(docString(doc))
+        if i >= 0 and int(self._doc_ids[i]) not in self._popped:
+            return int(self._doc_ids[i])
+        return None
+
+    def __contains__(self, doc):
+        return self._find(doc) is not None
+
+    def __getitem__(self, doc):
+        doc_id = self._find(doc)
+        if doc_id is None:
+            doc_id = self._new[doc] = self._next_id
+            self._next_id += 1
+        return doc_id
+
+    def pop(self, doc):
+        if doc in self._new:
+            return self._new.pop(doc)
+        doc_id = self._find(doc)
+        if doc_id is None:
+            raise KeyError(doc)
+        self._popped.add(doc_id)
+        return doc_id
+
+    def __len__(self):
+        return len(self._docs) - len(self._popped) + len(self._new)
+
+
+class MmapCanopy(object):
+    '''
+    Stands in for the canopy dict of a canopy predicate. Docs that
+    are added to canopies after it was written are only kept in memory.
+    '''
+    MISSING = -1
+    NONE = 0
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._centers = numpy.load(self.path, mmap_mode='r')
+        self._new = {}
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, d):
+        self.__init__(d['path'])
+
+    def _find(self, doc_id):
+        if doc_id in self._new:
+            return self._new[doc_id]
+        if doc_id < len(self._centers):
+            return int(self._centers[doc_id])
+        return self.MISSING
+
+    def __contains__(self, doc_id):
+        return self._find(doc_id) != self.MISSING
+
+    def __getitem__(self, doc_id):
+        center = self._find(doc_id)
+        if center == self.MISSING:
+            raise KeyError(doc_id)
+        elif center == self.NONE:
+            return None
+        return center
+
+    def __setitem__(self, doc_id, center):
+        self._new[doc_id] = self.NONE if center is None else center
+
+
+class StringTable(object):
+    '''
+    Strings, sorted by their hashes, that are looked up by hash and
+    then compared, so that hash collisions are never taken for a match
+    '''
+
+    def __init__(self, keys, offsets, strings):
+        self._keys = keys
+        self._offsets = offsets
+        self._strings = strings
+
+    def __len__(self):
+        return len(self._keys)
+
+    def find(self, string):
+        '''
+        Return the position of string in the table, or -1 if it is not
+        in the table
+        '''
+        key = hashKey(string)
+        encoded = string.encode('utf-8')
+
+        i = int(numpy.searchsorted(self._keys, key))
+        while i < len(self._keys) and self._keys[i] == key:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            if self._strings[start:end].tobytes() == encoded:
+                return i
+            i += 1
+
+        return -1
+
+
+def docString(doc):
+    if isinstance(doc, str):
+        return doc
+    elif isinstance(doc, (set, frozenset)):
+        return repr(sorted(doc, key=repr))
+    return repr(tuple(doc))
+
+
+def _concatenate(arrays, dtype):
+    if arrays:
+        return numpy.concatenate(arrays).astype(dtype, copy=False)
+    return numpy.zeros(0, dtype=dtype)
+
+
+def _save(directory, name, array):
+    numpy.save(os.path.join(directory, name + '.npy'), array)
+
+
+def _saveStrings(directory, name, strings):
+    '''
+    Save strings, which must already be sorted by their hashes, as a
+    StringTable
+    '''
+    encoded = [string.encode('utf-8') for string in strings]
+
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(string) for string in encoded], out=offsets[1:])
+
+    _save(directory, name,
+          numpy.array([hashKey(string) for string in strings],
+                      dtype=numpy.int64))
+    _save(directory, name + '_offsets', offsets)
+    _save(directory, name + '_strings',
+          numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8))
+
+
+def _loadStrings(directory, name):
+    return StringTable(_load(directory, name),
+                       _load(directory, name + '_offsets'),
+                       _load(directory, name + '_strings'))
+
+
+def _load(directory, name):
+    return numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
@@ -0,0 +1,48 @@
+import bisect
+import math
+
+from .index import Index
+from .core import Enumerator
+
+
+class SortedNeighborhoodIndex(Index):
+    '''
+    Sorted neighborhood blocking. The indexed docs are sorted, and a
+    window slides over them, half a window at a time. A search returns
+    the ids of the windows that a doc falls in, so each block has at
+    most as many distinct docs as the window is wide, however the docs
+    are distributed, and docs that are less than half a window apart
+    always share a block.
+
+    The width of the window is a fraction of the number of distinct
+    docs in the index, so blocks grow with the data, and a sample of
+    the data is blocked in proportion to all of it.
+
+    A doc that is not in the index falls where it would be inserted.
+    '''
+
+    def __init__(self):
+        self._doc_to_id = Enumerator(start=1)
+        self._index = []
+
+    def index(self, doc):
+        self._doc_to_id[doc]
+
+    def unindex(self, doc):
+        del self._doc_to_id[doc]
+
+    def initSearch(self):
+        self._index = sorted(self._doc_to_id)
+
+    def search(self, doc, threshold=0):
+        '''
+        threshold is the width of the window, as a fraction of the
+        distinct docs in the index
+        '''
+        window = max(math.ceil(threshold * len(self._index)), 2)
+        step = max(window // 2, 1)
+
+        position = bisect.bisect_left(self._index, doc)
+        first = max(-(-(position - window + 1) // step), 0)
+
+        return list(range(first, position // step + 1))
@@ -5,11 +5,15 @@ import re
 import math
 import itertools
 import string
+import functools
+import collections
 
 from doublemetaphone import doublemetaphone
-from dedupe.cpredicates import ngrams, initials
+from dedupe.cpredicates import ngrams, initials, charBlockKeys  # noqa: F401
 import dedupe.tfidf as tfidf
 import dedupe.levenshtein as levenshtein
+import dedupe.lsh as lsh
+import dedupe.neighborhood as neighborhood
 
 words = re.compile(r"[\w']+").findall
 integers = re.compile(r"\d+").findall
@@ -24,6 +28,16 @@ def strip_punc(s):
     return s.translate(PUNCTABLE)
 
 
+@functools.lru_cache(maxsize=1024)
+def normalize(s):
+    '''
+    Strip punctuation and collapse whitespace. Every string predicate
+    on a field normalizes the same value, so recent values are cached
+    and a record's field is only normalized once per blocking pass.
+    '''
+    return " ".join(strip_punc(s).split())
+
+
 class Predicate(object):
     def __iter__(self):
         yield self
@@ -69,7 +83,7 @@ class StringPredicate(SimplePredicate):
     def __call__(self, record, **kwargs):
         column = record[self.field]
         if column:
-            return self.func(" ".join(strip_punc(column).split()))
+            return self.func(normalize(column))
         else:
             return ()
 
@@ -110,6 +124,8 @@ class ExistsPredicate(Predicate):
 
 
 class IndexPredicate(Predicate):
+    index_class = None
+
     def __init__(self, threshold, field):
         self.__name__ = '(%s, %s)' % (threshold, field)
         self.field = field
@@ -143,17 +159,53 @@ class CanopyPredicate(object):
         super().__init__(*args, **kwargs)
         self.canopy = {}
         self._cache = {}
+        self._searched = {}
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+
+        # backwards compatibility
+        if not hasattr(self, '_searched'):
+            self._searched = {}
 
     def freeze(self, records):
         self._cache = {record[self.field]: self(record) for record in records}
         self.canopy = {}
+        self._searched = {}
         self.index = None
 
     def reset(self):
         self._cache = {}
         self.canopy = {}
+        self._searched = {}
         self.index = None
 
+    def searchAll(self, records, target=False):
+        '''
+        Search the index at once for the docs of a batch of records that
+        are not in a canopy yet, for the next calls to use. Which docs
+        are canopy centers still depends on the order they are called in.
+        '''
+        docs = {}
+        for record in records:
+            column = record[self.field]
+            if column and column not in self._cache:
+                doc = self.preprocess(column)
+                try:
+                    doc_id = self.index._doc_to_id[doc]
+                except AttributeError:
+                    raise AttributeError("Attempting to block with an index "
+                                         "predicate without indexing records")
+                if doc_id not in self.canopy:
+                    docs[doc_id] = doc
+
+        if docs:
+            results = self.index.searchMany(list(docs.values()),
+                                            self.threshold)
+            self._searched = dict(zip(docs, results))
+        else:
+            self._searched = {}
+
     def __call__(self, record, **kwargs):
         block_key = None
         column = record[self.field]
@@ -173,8 +225,10 @@ class CanopyPredicate(object):
             if doc_id in self.canopy:
                 block_key = self.canopy[doc_id]
             else:
-                canopy_members = self.index.search(doc,
-                                                   self.threshold)
+                canopy_members = self._searched.pop(doc_id, None)
+                if canopy_members is None:
+                    canopy_members = self.index.search(doc,
+                                                       self.threshold)
                 for member in canopy_members:
                     if member not in self.canopy:
                         self.canopy[member] = doc_id
@@ -207,6 +261,33 @@ class SearchPredicate(object):
         self._cache = {}
         self.index = None
 
+    def searchAll(self, records, target=False):
+        '''
+        Search the index at once for the docs of a batch of records,
+        caching the results for the next calls
+        '''
+        if target:
+            return
+
+        columns = {record[self.field] for record in records}
+        columns = [column for column in columns
+                   if column and (column, False) not in self._cache]
+
+        if not columns:
+            return
+
+        try:
+            results = self.index.searchMany([self.preprocess(column)
+                                             for column in columns],
+                                            self.threshold)
+        except AttributeError:
+            raise AttributeError("Attempting to block with an index "
+                                 "predicate without indexing records")
+
+        for column, centers in zip(columns, results):
+            self._cache[(column, False)] = [str(center)
+                                            for center in centers]
+
     def __call__(self, record, target=False, **kwargs):
         column = record[self.field]
         if column:
@@ -231,9 +312,13 @@ class SearchPredicate(object):
 
 
 class TfidfPredicate(IndexPredicate):
+    # set to tfidf.CsrTfIdfIndex by the 'tfidf index' option of a
+    # field definition
+    index_class = tfidf.TfIdfIndex
+
     def initIndex(self):
         self.reset()
-        return tfidf.TfIdfIndex()
+        return self.index_class()
 
 
 class TfidfCanopyPredicate(CanopyPredicate, TfidfPredicate):
@@ -257,7 +342,7 @@ class TfidfSetPredicate(object):
 
 class TfidfNGramPredicate(object):
     def preprocess(self, doc):
-        return tuple(sorted(ngrams(" ".join(strip_punc(doc).split()), 2)))
+        return tuple(sorted(ngrams(normalize(doc), 2)))
 
 
 class TfidfTextSearchPredicate(TfidfTextPredicate,
@@ -291,12 +376,14 @@ class TfidfNGramCanopyPredicate(TfidfNGramPredicate,
 
 
 class LevenshteinPredicate(IndexPredicate):
+    index_class = levenshtein.LevenshteinIndex
+
     def initIndex(self):
         self.reset()
-        return levenshtein.LevenshteinIndex()
+        return self.index_class()
 
     def preprocess(self, doc):
-        return " ".join(strip_punc(doc).split())
+        return normalize(doc)
 
 
 class LevenshteinCanopyPredicate(CanopyPredicate, LevenshteinPredicate):
@@ -307,6 +394,111 @@ class LevenshteinSearchPredicate(SearchPredicate, LevenshteinPredicate):
     type = "LevenshteinSearchPredicate"
 
 
+class LSHPredicate(IndexPredicate):
+    index_class = lsh.MinHashLSH
+
+    def initIndex(self):
+        self.reset()
+        return self.index_class()
+
+
+class LSHCanopyPredicate(CanopyPredicate, LSHPredicate):
+    pass
+
+
+class LSHSearchPredicate(SearchPredicate, LSHPredicate):
+    pass
+
+
+class LSHTextSearchPredicate(TfidfTextPredicate, LSHSearchPredicate):
+    type = "LSHTextSearchPredicate"
+
+
+class LSHSetSearchPredicate(TfidfSetPredicate, LSHSearchPredicate):
+    type = "LSHSetSearchPredicate"
+
+
+class LSHNGramSearchPredicate(TfidfNGramPredicate, LSHSearchPredicate):
+    type = "LSHNGramSearchPredicate"
+
+
+class LSHTextCanopyPredicate(TfidfTextPredicate, LSHCanopyPredicate):
+    type = "LSHTextCanopyPredicate"
+
+
+class LSHSetCanopyPredicate(TfidfSetPredicate, LSHCanopyPredicate):
+    type = "LSHSetCanopyPredicate"
+
+
+class LSHNGramCanopyPredicate(TfidfNGramPredicate, LSHCanopyPredicate):
+    type = "LSHNGramCanopyPredicate"
+
+
+class SortedNeighborhoodPredicate(IndexPredicate):
+    '''
+    Blocks together the values of a field that are near each other in
+    sorted order. The threshold is the width of the window, as a
+    fraction of the distinct values in the index.
+
+    Records are blocked the same way whether their values are in the
+    index or not, so these predicates can be used for deduplication and
+    for record linkage.
+    '''
+    type = "SortedNeighborhoodPredicate"
+    index_class = neighborhood.SortedNeighborhoodIndex
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cache = {}
+
+    def initIndex(self):
+        self.reset()
+        return self.index_class()
+
+    def preprocess(self, doc):
+        return normalize(doc).lower()
+
+    def freeze(self, *records_lists):
+        self._cache = {record[self.field]: self(record)
+                       for records in records_lists
+                       for record in records}
+        self.index = None
+
+    def reset(self):
+        self._cache = {}
+        self.index = None
+
+    def __call__(self, record, **kwargs):
+        column = record[self.field]
+        if not column:
+            return ()
+
+        if column in self._cache:
+            return self._cache[column]
+
+        try:
+            windows = self.index.search(self.preprocess(column),
+                                        self.threshold)
+        except AttributeError:
+            raise AttributeError("Attempting to block with an index "
+                                 "predicate without indexing records")
+
+        result = [str(window) for window in windows]
+        self._cache[column] = result
+        return result
+
+
+class ReversedSortedNeighborhoodPredicate(SortedNeighborhoodPredicate):
+    '''
+    Sorts the values of a field by their reversal, to find the
+    neighbors of values that differ in their first characters
+    '''
+    type = "ReversedSortedNeighborhoodPredicate"
+
+    def preprocess(self, doc):
+        return super().preprocess(doc)[::-1]
+
+
 class CompoundPredicate(tuple):
     type = "CompoundPredicate"
 
@@ -402,45 +594,47 @@ def fingerprint(field):
     return (u''.join(sorted(field.split())).strip(),)
 
 
+# the character level predicates of a field share one pass of
+# charBlockKeys, and every string predicate on a field sees the same
+# value, so the last values' keys are cached
+charKeys = functools.lru_cache(maxsize=1024)(charBlockKeys)
+
+
 def oneGramFingerprint(field):
-    return (u''.join(sorted(set(ngrams(field.replace(' ', ''), 1)))).strip(),)
+    return charKeys(field)[1]
 
 
 def twoGramFingerprint(field):
-    if len(field) > 1:
-        return (u''.join(sorted(gram.strip() for gram
-                                in set(ngrams(field.replace(' ', ''), 2)))),)
-    else:
-        return ()
+    return charKeys(field)[2]
 
 
 def commonFourGram(field):
     """return 4-grams"""
-    return set(ngrams(field.replace(' ', ''), 4))
+    return charKeys(field)[3]
 
 
 def commonSixGram(field):
     """return 6-grams"""
-    return set(ngrams(field.replace(' ', ''), 6))
+    return charKeys(field)[4]
 
 
 def sameThreeCharStartPredicate(field):
     """return first three characters"""
-    return initials(field.replace(' ', ''), 3)
+    return charKeys(field)[5]
 
 
 def sameFiveCharStartPredicate(field):
     """return first five characters"""
-    return initials(field.replace(' ', ''), 5)
+    return charKeys(field)[6]
 
 
 def sameSevenCharStartPredicate(field):
     """return first seven characters"""
-    return initials(field.replace(' ', ''), 7)
+    return charKeys(field)[7]
 
 
 def suffixArray(field):
-    field = field.replace(' ', '')
+    field = charKeys(field)[0]
     n = len(field) - 4
     if n > 0:
         for i in range(0, n):
@@ -451,13 +645,42 @@ def sortedAcronym(field):
     return (''.join(sorted(each[0] for each in field.split())),)
 
 
+PhoneticCacheInfo = collections.namedtuple('PhoneticCacheInfo',
+                                           ['hits', 'misses', 'maxsize',
+                                            'currsize', 'hit_rate'])
+
+
+def setPhoneticCacheSize(maxsize=10000):
+    '''
+    Memoize the phonetic encodings of the last maxsize values and
+    tokens, or of all of them if maxsize is None. Names and their
+    tokens repeat heavily, so a cache of the commonest ones saves most
+    of the encoding. Resets the cache and its statistics.
+    '''
+    global _doublemetaphone
+    _doublemetaphone = functools.lru_cache(maxsize=maxsize)(doublemetaphone)
+
+
+def phoneticCacheInfo():
+    '''
+    Statistics of the phonetic encoding cache, in this process
+    '''
+    hits, misses, maxsize, currsize = _doublemetaphone.cache_info()
+    lookups = hits + misses
+    return PhoneticCacheInfo(hits, misses, maxsize, currsize,
+                             hits / lookups if lookups else 0.0)
+
+
+setPhoneticCacheSize()
+
+
 def doubleMetaphone(field):
-    return {metaphone for metaphone in doublemetaphone(field) if metaphone}
+    return {metaphone for metaphone in _doublemetaphone(field) if metaphone}
 
 
 def metaphoneToken(field):
     return {metaphone_token for metaphone_token
-            in itertools.chain(*(doublemetaphone(token)
+            in itertools.chain(*(_doublemetaphone(token)
                                  for token in set(field.split())))
             if metaphone_token}
 
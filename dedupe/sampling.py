@@ -204,7 +204,7 @@ def sort_pair(a, b):
 
 
 def randomDeque(data):
-    data_q = deque(random.sample(data.items(), len(data)))
+    data_q = deque(random.sample(list(data.items()), len(data)))
 
     return data_q
 
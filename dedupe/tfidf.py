@@ -1,6 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import logging
+import math
+from collections import Counter
+
+import numpy
+from BTrees.Length import Length
+from zope.index.text import widcode
 
 from .canopy_index import CanopyIndex
 from .index import Index
@@ -9,6 +15,23 @@ from .core import Enumerator
 logger = logging.getLogger(__name__)
 
 
+def indexShard(docs):
+    '''
+    Index (doc_id, doc) pairs in a new CanopyIndex, to be merged into
+    a TfIdfIndex. The shard is returned as plain lists and dicts, since
+    large BTrees are too deeply nested to pickle outside of a database.
+    '''
+    shard = CanopyIndex()
+    for doc_id, doc in docs:
+        shard.index_doc(doc_id, doc)
+
+    index = shard.index
+    return (list(shard.lexicon._words.items()),
+            [(wid, dict(docs)) for wid, docs in index._wordinfo.items()],
+            list(index._docweight.items()),
+            list(index._docwords.items()))
+
+
 class TfIdfIndex(Index):
     def __init__(self):
         self._index = CanopyIndex()
@@ -20,9 +43,64 @@ class TfIdfIndex(Index):
             i = self._doc_to_id[doc]
             self._index.index_doc(i, doc)
 
+    def numberDocs(self, docs):
+        '''
+        Give new docs their ids, without indexing them. Returns a list
+        of (doc_id, doc) pairs of the docs that were not in the index,
+        to be indexed with indexShard and merged back in.
+        '''
+        new_docs = []
+        for doc in docs:
+            if doc not in self._doc_to_id:
+                new_docs.append((self._doc_to_id[doc], doc))
+
+        return new_docs
+
+    def merge(self, shards):
+        '''
+        Add the docs of the shards built by indexShard. The shards each
+        have their own word ids, which are mapped to the word ids of
+        this index.
+        '''
+        index = self._index.index
+        lexicon = self._index.lexicon
+        IFBTree = index.family.IF.BTree
+
+        for shard_words, shard_wordinfo, shard_docweight, shard_docwords in shards:
+            wids = lexicon.sourceToWordIds([word for _, word in shard_words])
+            wid_map = {shard_wid: wid for (shard_wid, _), wid
+                       in zip(shard_words, wids)}
+
+            for shard_wid, shard_docs in shard_wordinfo:
+                wid = wid_map[shard_wid]
+                docs = index._wordinfo.get(wid)
+                if docs is None:
+                    docs = shard_docs
+                else:
+                    docs.update(shard_docs)
+                if isinstance(docs, dict) and len(docs) > index.DICT_CUTOFF:
+                    docs = IFBTree(docs)
+                index._wordinfo[wid] = docs
+
+            index._docweight.update(shard_docweight)
+            for doc_id, shard_code in shard_docwords:
+                index._docwords[doc_id] = widcode.encode(
+                    [wid_map[shard_wid]
+                     for shard_wid in widcode.decode(shard_code)])
+
+            index.documentCount.change(len(shard_docweight))
+
+        index.wordCount = Length(len(index._wordinfo))
+
     def unindex(self, doc):
-        i = self._doc_to_id.pop(doc)
-        self._index.unindex_doc(i)
+        self.unindexAll((doc,))
+
+    def unindexAll(self, docs):
+        # the idf weights and stop words are recomputed over the whole
+        # corpus, so only do it once for a batch of docs
+        for doc in docs:
+            i = self._doc_to_id.pop(doc)
+            self._index.unindex_doc(i)
         self.initSearch()
 
     def initSearch(self):
@@ -38,3 +116,265 @@ class TfIdfIndex(Index):
             results = []
 
         return results
+
+    def searchMany(self, docs, threshold=0):
+        # a batch of records often shares docs, search for them once
+        apply = self._index.apply
+        parseTerms = self._parseTerms
+
+        results = {}
+        for doc in docs:
+            if doc not in results:
+                query_list = parseTerms(doc)
+                if query_list:
+                    results[doc] = [center for score, center
+                                    in apply(query_list, threshold)]
+                else:
+                    results[doc] = []
+
+        return [results[doc] for doc in docs]
+
+
+class CsrTfIdfIndex(Index):
+    '''
+    A TF-IDF index that gives the same scores as TfIdfIndex, kept as a
+    compressed sparse row term-document matrix in numpy arrays. Many
+    docs can be searched at once with searchMany, which is much faster
+    than searching them one at a time.
+
+    Indexed docs are only added to the matrix by initSearch.
+    '''
+
+    def __init__(self):
+        self._index = TermDocMatrix()
+        self._doc_to_id = Enumerator(start=1)
+        self._added = []
+        self._removed = set()
+
+    def index(self, doc):
+        if doc not in self._doc_to_id:
+            self._added.append((self._doc_to_id[doc], doc))
+
+    def unindex(self, doc):
+        self.unindexAll((doc,))
+
+    def unindexAll(self, docs):
+        for doc in docs:
+            self._removed.add(self._doc_to_id.pop(doc))
+        self.initSearch()
+
+    def initSearch(self):
+        self._index.update(self._added, self._removed, len(self._doc_to_id))
+        self._added = []
+        self._removed = set()
+
+    def search(self, doc, threshold=0):
+        return self.searchMany([doc], threshold)[0]
+
+    def searchMany(self, docs, threshold=0):
+        '''
+        Returns a list with the ids of the docs that match each of docs,
+        best match first
+        '''
+        return self._index.search([_queryTerms(doc) for doc in docs],
+                                  threshold)
+
+
+class TermDocMatrix(object):
+    '''
+    The CSR term-document matrix of a CsrTfIdfIndex. Row i holds the
+    weights, w(d, t) / W(d) in the notation of zope's CosineIndex, of
+    term `terms[i]` in the docs `postings[indptr[i]:indptr[i + 1]]`.
+
+    Stop words, which are in more than 5% of docs and more than 1000
+    docs, stay in the matrix, with an idf of 0, so that they can come
+    back if docs are unindexed.
+    '''
+
+    def __init__(self):
+        self.terms = []
+        self.rows = {}
+        self.indptr = numpy.zeros(1, dtype=numpy.int64)
+        self.postings = numpy.zeros(0, dtype=numpy.int64)
+        self.weights = numpy.zeros(0, dtype=numpy.float32)
+        self.idf = numpy.zeros(0, dtype=numpy.float64)
+
+    def _row(self, term):
+        row = self.rows.get(term)
+        if row is None:
+            row = self.rows[term] = len(self.terms)
+            self.terms.append(term)
+        return row
+
+    def update(self, added, removed, n_docs):
+        rows = numpy.repeat(numpy.arange(len(self.terms)),
+                            numpy.diff(self.indptr))
+        postings = self.postings
+        weights = self.weights
+
+        if removed:
+            keep = ~numpy.isin(postings, list(removed))
+            rows, postings, weights = rows[keep], postings[keep], weights[keep]
+
+        new_rows, new_postings, new_weights = [], [], []
+        for doc_id, doc in added:
+            if doc_id in removed:
+                continue
+            doc_weights = {term: 1.0 + math.log(count)
+                           for term, count in Counter(doc).items()}
+            norm = math.sqrt(sum(weight ** 2
+                                 for weight in doc_weights.values()))
+            for term, weight in doc_weights.items():
+                new_rows.append(self._row(term))
+                new_postings.append(doc_id)
+                new_weights.append(weight / norm)
+
+        rows = numpy.concatenate([rows, new_rows]).astype(numpy.int64)
+        postings = numpy.concatenate([postings,
+                                      new_postings]).astype(numpy.int64)
+        weights = numpy.concatenate([weights,
+                                     new_weights]).astype(numpy.float32)
+
+        order = numpy.lexsort((postings, rows))
+        rows = rows[order]
+        self.postings = postings[order]
+        self.weights = weights[order]
+
+        # keys of the (term, doc) entries, which are sorted, so that the
+        # weight of a term in a doc can be found by binary search
+        self.stride = int(self.postings.max(initial=0)) + 1
+        self.keys = rows * self.stride + self.postings
+
+        doc_freqs = numpy.bincount(rows, minlength=len(self.terms))
+        self.indptr = numpy.zeros(len(self.terms) + 1, dtype=numpy.int64)
+        numpy.cumsum(doc_freqs, out=self.indptr[1:])
+
+        self.max_weights = numpy.zeros(len(self.terms), dtype=numpy.float32)
+        if len(self.weights):
+            nonempty = doc_freqs > 0
+            self.max_weights[nonempty] = numpy.maximum.reduceat(
+                self.weights, self.indptr[:-1][nonempty])
+
+        stop_words = doc_freqs > int(max(1000, n_docs * 0.05))
+        for row in numpy.flatnonzero(stop_words):
+            logger.info('Removing stop word {}'.format(self.terms[row]))
+
+        live = (doc_freqs > 0) & ~stop_words
+        self.idf = numpy.zeros(len(self.terms), dtype=numpy.float64)
+        self.idf[live] = numpy.log1p(n_docs / doc_freqs[live])
+
+    def search(self, queries, threshold):
+        '''
+        Score every query against every doc at once, as the product of
+        the sparse query-term matrix and this term-document matrix
+        '''
+        query_ids, query_rows = [], []
+        rows = self.rows
+        for i, terms in enumerate(queries):
+            for term in terms:
+                row = rows.get(term)
+                if row is not None:
+                    query_ids.append(i)
+                    query_rows.append(row)
+
+        query_ids = numpy.array(query_ids, dtype=numpy.int64)
+        query_rows = numpy.array(query_rows, dtype=numpy.int64)
+
+        idf = self.idf[query_rows]
+        live = idf > 0
+        query_ids, query_rows, idf = (query_ids[live], query_rows[live],
+                                      idf[live])
+
+        query_norms = numpy.sqrt(numpy.bincount(query_ids, weights=idf ** 2,
+                                                minlength=len(queries)))
+        min_scores = query_norms * threshold
+
+        # threshold pruning: a doc that only has the terms of a query
+        # whose largest possible scores add up to less than the
+        # minimum score can't match, so the candidate docs are only
+        # looked for in the postings of the query's other, essential,
+        # terms
+        max_scores = idf * self.max_weights[query_rows]
+        order = numpy.lexsort((max_scores, query_ids))
+        query_ids, query_rows, idf, max_scores = (query_ids[order],
+                                                  query_rows[order],
+                                                  idf[order],
+                                                  max_scores[order])
+        cumulative = numpy.cumsum(max_scores)
+        group_starts = numpy.searchsorted(query_ids, query_ids)
+        cumulative -= cumulative[group_starts] - max_scores[group_starts]
+        essential = cumulative >= min_scores[query_ids] * (1 - 1e-6)
+
+        starts = self.indptr[query_rows[essential]]
+        lengths = self.indptr[query_rows[essential] + 1] - starts
+        positions = _ranges(starts, lengths)
+
+        stride = self.stride
+        keys = (numpy.repeat(query_ids[essential], lengths) * stride +
+                self.postings[positions])
+        scores = (self.weights[positions] *
+                  numpy.repeat(idf[essential], lengths))
+
+        keys, inverse = numpy.unique(keys, return_inverse=True)
+        scores = numpy.bincount(inverse, weights=scores,
+                                minlength=len(keys))
+        candidate_queries, doc_ids = numpy.divmod(keys, stride)
+
+        # drop the candidates that can't match even if they have all of
+        # the non-essential terms, then add the scores of the terms
+        # they do have
+        other = ~essential
+        other_max_scores = numpy.bincount(query_ids[other],
+                                          weights=max_scores[other],
+                                          minlength=len(queries))
+        possible = (scores + other_max_scores[candidate_queries] >=
+                    min_scores[candidate_queries] * (1 - 1e-6))
+        keys, scores, candidate_queries, doc_ids = (keys[possible],
+                                                    scores[possible],
+                                                    candidate_queries[possible],
+                                                    doc_ids[possible])
+
+        other_queries = query_ids[other]
+        n_other = numpy.bincount(other_queries, minlength=len(queries))
+        lengths = n_other[candidate_queries]
+        candidates = numpy.repeat(numpy.arange(len(keys)), lengths)
+        others = _ranges(numpy.searchsorted(other_queries,
+                                            candidate_queries),
+                         lengths)
+        term_keys = (query_rows[other][others] * stride +
+                     doc_ids[candidates])
+        found = numpy.searchsorted(self.keys, term_keys)
+        found[found == len(self.keys)] = 0
+        hits = self.keys[found] == term_keys
+        scores += numpy.bincount(candidates[hits],
+                                 weights=(self.weights[found[hits]] *
+                                          idf[other][others[hits]]),
+                                 minlength=len(keys))
+
+        keep = scores >= min_scores[candidate_queries]
+        candidate_queries, doc_ids, scores = (candidate_queries[keep],
+                                              doc_ids[keep], scores[keep])
+
+        order = numpy.lexsort((-doc_ids, -scores, candidate_queries))
+        doc_ids = doc_ids[order].tolist()
+        bounds = numpy.searchsorted(candidate_queries[order],
+                                    numpy.arange(len(queries) + 1)).tolist()
+
+        return [doc_ids[start:end]
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _ranges(starts, lengths):
+    '''
+    The concatenation of range(start, start + length) for each of
+    starts and lengths
+    '''
+    ends = numpy.cumsum(lengths)
+    return (numpy.arange(ends[-1] if len(ends) else 0) +
+            numpy.repeat(starts - ends + lengths, lengths))
+
+
+def _queryTerms(doc):
+    if isinstance(doc, str):
+        return (doc,)
+    return doc
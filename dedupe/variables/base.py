@@ -1,4 +1,4 @@
-from dedupe import predicates
+from dedupe import predicates, tfidf
 
 
 class Variable(object):
@@ -49,8 +49,28 @@ class MissingDataType(Variable):
 class FieldType(Variable):
     _index_thresholds = []
     _index_predicates = []
+
+    # MinHash LSH predicates are only tried at the thresholds a field
+    # definition asks for with 'lsh thresholds'. They search the same
+    # signatures with a different banding, so few are worth trying.
+    _lsh_thresholds = ()
+    _lsh_predicates = []
     _Predicate = predicates.SimplePredicate
 
+    # Field types that can compare whole columns of values at once
+    # should set this to a function that takes two equal length
+    # sequences of field values and returns an array of distances
+    column_comparator = None
+
+    # The range of distances the comparator can return, used to bound
+    # the score of a record pair before it is compared
+    distance_bounds = (float('-inf'), float('inf'))
+
+    # Field types with an expensive comparator can set this to a cheap
+    # function that takes two equal length sequences of field values
+    # and returns a lower bound on each pair's distance
+    column_lower_bound = None
+
     def __init__(self, definition):
         self.field = definition['field']
 
@@ -62,10 +82,26 @@ class FieldType(Variable):
         self.predicates = [self._Predicate(pred, self.field)
                            for pred in self._predicate_functions]
 
-        self.predicates += indexPredicates(self._index_predicates,
+        index_predicates = indexPredicates(self._index_predicates,
                                            self._index_thresholds,
                                            self.field)
 
+        tfidf_index = definition.get('tfidf index', 'zope')
+        if tfidf_index == 'csr':
+            for predicate in index_predicates:
+                if isinstance(predicate, predicates.TfidfPredicate):
+                    predicate.index_class = tfidf.CsrTfIdfIndex
+        elif tfidf_index != 'zope':
+            raise ValueError("'tfidf index' must be 'zope' or 'csr', "
+                             "not %r" % tfidf_index)
+
+        self.predicates += index_predicates
+
+        self.predicates += indexPredicates(self._lsh_predicates,
+                                           definition.get('lsh thresholds',
+                                                          self._lsh_thresholds),
+                                           self.field)
+
         super(FieldType, self).__init__(definition)
 
 
@@ -1,3 +1,5 @@
+import numpy
+
 from .base import FieldType, DerivedType
 from dedupe import predicates
 from categorical import CategoricalComparator
@@ -32,3 +34,21 @@ class CategoricalType(FieldType):
 
     def __len__(self):
         return len(self.higher_vars)
+
+    def column_comparator(self, column_1, column_2):
+        levels = {level: i for i, level in enumerate(self.comparator.levels)}
+        responses = numpy.array([[self.comparator(level_1, level_2)
+                                  for level_2 in levels]
+                                 for level_1 in levels])
+
+        try:
+            index_1 = [levels[value] for value in column_1]
+            index_2 = [levels[value] for value in column_2]
+        except KeyError:
+            # let the comparator raise its error about undeclared
+            # categories
+            return numpy.array([self.comparator(value_1, value_2)
+                                for value_1, value_2
+                                in zip(column_1, column_2)])
+
+        return responses[index_1, index_2]
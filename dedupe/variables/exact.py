@@ -1,3 +1,7 @@
+import operator
+
+import numpy
+
 from .base import FieldType
 from dedupe import predicates
 
@@ -12,3 +16,9 @@ class ExactType(FieldType):
             return 1
         else:
             return 0
+
+    @staticmethod
+    def column_comparator(column_1, column_2):
+        return numpy.fromiter(map(operator.eq, column_1, column_2),
+                              dtype='f4',
+                              count=len(column_1))
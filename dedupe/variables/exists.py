@@ -1,3 +1,5 @@
+import numpy
+
 from .base import DerivedType
 from categorical import CategoricalComparator
 from .categorical_type import CategoricalType
@@ -31,3 +33,16 @@ class ExistsType(CategoricalType):
     # This flag tells fieldDistances in dedupe.core to pass
     # missing values (None) into the comparator
     comparator.missing = True
+
+    def column_comparator(self, column_1, column_2):
+        responses = numpy.array([self.cat_comparator(0, 0),
+                                 self.cat_comparator(0, 1),
+                                 self.cat_comparator(1, 1)])
+
+        n_present = numpy.fromiter((bool(value_1) + bool(value_2)
+                                    for value_1, value_2
+                                    in zip(column_1, column_2)),
+                                   dtype=int,
+                                   count=len(column_1))
+
+        return responses[n_present]
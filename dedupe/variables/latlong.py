@@ -1,9 +1,15 @@
-from math import sqrt
+from math import sqrt, radians
+
+import numpy
 
 from .base import FieldType
 from dedupe import predicates
 from haversine import haversine
 
+# Recover the earth radius that haversine uses, so that the vectorized
+# comparator agrees with the scalar one
+EARTH_RADIUS = haversine((0, 0), (0, 1)) / radians(1)
+
 
 class LatLongType(FieldType):
     type = "LatLong"
@@ -13,3 +19,14 @@ class LatLongType(FieldType):
     @staticmethod
     def comparator(x, y):
         return sqrt(haversine(x, y))
+
+    @staticmethod
+    def column_comparator(points_1, points_2):
+        lat_1, lng_1 = numpy.radians(numpy.asarray(points_1, dtype=float)).T
+        lat_2, lng_2 = numpy.radians(numpy.asarray(points_2, dtype=float)).T
+
+        d = (numpy.sin((lat_2 - lat_1) / 2) ** 2 +
+             numpy.cos(lat_1) * numpy.cos(lat_2) *
+             numpy.sin((lng_2 - lng_1) / 2) ** 2)
+
+        return numpy.sqrt(2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(d)))
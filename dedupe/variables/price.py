@@ -17,3 +17,16 @@ class PriceType(FieldType):
             return numpy.nan
         else:
             return abs(numpy.log10(price_1) - numpy.log10(price_2))
+
+    @staticmethod
+    def column_comparator(prices_1, prices_2):
+        prices_1 = numpy.asarray(prices_1, dtype=float)
+        prices_2 = numpy.asarray(prices_2, dtype=float)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            distances = numpy.abs(numpy.log10(prices_1) -
+                                  numpy.log10(prices_2))
+
+        distances[(prices_1 <= 0) | (prices_2 <= 0)] = numpy.nan
+
+        return distances
@@ -5,6 +5,7 @@ from simplecosine.cosine import CosineSetSimilarity
 
 class SetType(FieldType):
     type = "Set"
+    distance_bounds = (0, 1)
 
     _predicate_functions = (predicates.wholeSetPredicate,
                             predicates.commonSetElementPredicate,
@@ -17,6 +18,8 @@ class SetType(FieldType):
     _index_predicates = (predicates.TfidfSetSearchPredicate,
                          predicates.TfidfSetCanopyPredicate)
     _index_thresholds = (0.2, 0.4, 0.6, 0.8)
+    _lsh_predicates = (predicates.LSHSetSearchPredicate,
+                       predicates.LSHSetCanopyPredicate)
 
     def __init__(self, definition):
         super(SetType, self).__init__(definition)
@@ -1,3 +1,5 @@
+import numpy
+
 from .base import FieldType, indexPredicates
 from dedupe import predicates
 
@@ -38,9 +40,16 @@ class BaseStringType(FieldType):
                                            (1, 2, 3, 4),
                                            self.field)
 
+        windows = definition.get('neighborhood windows', ())
+        self.predicates += indexPredicates((predicates.SortedNeighborhoodPredicate,
+                                            predicates.ReversedSortedNeighborhoodPredicate),
+                                           windows,
+                                           self.field)
+
 
 class ShortStringType(BaseStringType):
     type = "ShortString"
+    distance_bounds = (0, float('inf'))
 
     _predicate_functions = (base_predicates +
                             (predicates.commonFourGram,
@@ -61,6 +70,7 @@ class ShortStringType(BaseStringType):
             self.comparator = crfEd
         else:
             self.comparator = affineGap
+            self.column_lower_bound = affineGapLowerBound
 
 
 class StringType(ShortStringType):
@@ -70,16 +80,23 @@ class StringType(ShortStringType):
                          predicates.TfidfNGramSearchPredicate,
                          predicates.TfidfTextCanopyPredicate,
                          predicates.TfidfTextSearchPredicate)
+    _lsh_predicates = (predicates.LSHNGramCanopyPredicate,
+                       predicates.LSHNGramSearchPredicate,
+                       predicates.LSHTextCanopyPredicate,
+                       predicates.LSHTextSearchPredicate)
 
 
 class TextType(BaseStringType):
     type = "Text"
+    distance_bounds = (0, 1)
 
     _predicate_functions = base_predicates
 
     _index_predicates = (predicates.TfidfTextCanopyPredicate,
                          predicates.TfidfTextSearchPredicate)
     _index_thresholds = (0.2, 0.4, 0.6, 0.8)
+    _lsh_predicates = (predicates.LSHTextCanopyPredicate,
+                       predicates.LSHTextSearchPredicate)
 
     def __init__(self, definition):
         super(TextType, self).__init__(definition)
@@ -88,3 +105,30 @@ class TextType(BaseStringType):
             definition['corpus'] = []
 
         self.comparator = CosineTextSimilarity(definition['corpus'])
+
+
+def affineGapLowerBound(strings_1, strings_2):
+    '''
+    Lower bound of the normalized affine gap distance from the lengths
+    of the strings alone. With the default weights, aligning a
+    character costs at least 1, and every character of the longer
+    string that is not aligned costs at least 0.875, the cost of
+    extending an abbreviation gap. So the distance is at least
+
+        (shorter + 0.875 * (longer - shorter)) / (shorter + longer)
+    '''
+    lengths_1 = numpy.fromiter((len(string) for string in strings_1),
+                               dtype=float, count=len(strings_1))
+    lengths_2 = numpy.fromiter((len(string) for string in strings_2),
+                               dtype=float, count=len(strings_2))
+
+    shorter = numpy.minimum(lengths_1, lengths_2)
+    longer = numpy.maximum(lengths_1, lengths_2)
+    total = shorter + longer
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        bounds = (shorter + 0.875 * (longer - shorter)) / total
+
+    bounds[total == 0] = 0
+
+    return bounds
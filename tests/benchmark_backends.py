@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Times scoring through a core.ScoringPool of each backend for a growing
+number of record pairs, to find where processes start paying for the
+cost of pickling record pairs and starting workers.
+
+The serial, thread and process columns start a pool for every call,
+as a single call to match does. The warm process column reuses one
+process pool across calls, as a Matching object used as a context
+manager does. The legacy column is scoreDuplicates without a pool,
+which starts its own queue-fed processes.
+
+    python tests/benchmark_backends.py --cores 4
+"""
+import csv
+import itertools
+import multiprocessing
+import optparse
+import os
+import time
+
+import exampleIO
+
+import dedupe
+import dedupe.core
+
+
+optp = optparse.OptionParser()
+optp.add_option('-c', '--cores', dest='num_cores', type='int',
+                default=multiprocessing.cpu_count(),
+                help='Number of workers for each backend')
+optp.add_option('-r', '--repeats', dest='repeats', type='int', default=3,
+                help='Number of times to time each run, the best is kept')
+(opts, args) = optp.parse_args()
+
+
+def canonicalImport(filename):
+    data_d = {}
+
+    with open(filename) as f:
+        reader = csv.DictReader(f)
+        for i, row in enumerate(reader):
+            data_d[i] = {k: exampleIO.preProcess(v) for k, v in row.items()}
+
+    return data_d
+
+
+def candidatePairs(data_d, n_pairs):
+    records = [(record_id, record, set())
+               for record_id, record in data_d.items()]
+    pairs = itertools.combinations(records, 2)
+
+    return list(itertools.islice(pairs, n_pairs))
+
+
+data_d = canonicalImport('tests/datasets/restaurant-nophone.csv')
+
+fields = [{'field': 'name', 'type': 'String'},
+          {'field': 'address', 'type': 'String'},
+          {'field': 'cuisine', 'type': 'ShortString', 'has missing': True},
+          {'field': 'city', 'type': 'ShortString'}]
+
+deduper = dedupe.Dedupe(fields)
+data_model = deduper.data_model
+classifier = deduper.classifier
+classifier.weights = [-1.0] * len(data_model)
+classifier.bias = 2.0
+
+
+def score(candidates, pool=None):
+    scored_pairs = dedupe.core.scoreDuplicates(iter(candidates),
+                                               data_model,
+                                               classifier,
+                                               opts.num_cores,
+                                               pool=pool)
+    try:
+        scored_pairs_file = scored_pairs.filename
+        del scored_pairs
+        os.remove(scored_pairs_file)
+    except AttributeError:
+        pass
+
+
+def scoreWithPool(backend):
+    def timed(candidates):
+        with dedupe.core.ScoringPool(opts.num_cores, data_model, classifier,
+                                     backend) as pool:
+            score(candidates, pool)
+    return timed
+
+
+warm_pool = dedupe.core.ScoringPool(opts.num_cores, data_model, classifier,
+                                    'process')
+
+columns = (('serial', scoreWithPool('serial')),
+           ('thread', scoreWithPool('thread')),
+           ('process', scoreWithPool('process')),
+           ('warm', lambda candidates: score(candidates, warm_pool)),
+           ('legacy', score))
+
+print('cores: %d' % opts.num_cores)
+print('%10s' % 'pairs' + ''.join('%10s' % name for name, _ in columns))
+
+for n_pairs in (1000, 10000, 100000, 300000):
+    candidates = candidatePairs(data_d, n_pairs)
+
+    timings = []
+    for _, run in columns:
+        best = float('inf')
+        for _ in range(opts.repeats):
+            t0 = time.perf_counter()
+            run(candidates)
+            best = min(best, time.perf_counter() - t0)
+        timings.append(best)
+
+    print('%10d' % len(candidates) +
+          ''.join('%10.3f' % timing for timing in timings))
+
+warm_pool.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Times the character level predicates of a String field, computed by
+the charBlockKeys kernel, against computing each predicate's keys
+separately, on the restaurant dataset, and checks that both give the
+same keys.
+
+    python tests/benchmark_char_predicates.py --repeats 5
+"""
+import csv
+import optparse
+import time
+
+import exampleIO
+
+import dedupe
+from dedupe.cpredicates import ngrams, initials
+from dedupe.predicates import StringPredicate
+
+
+optp = optparse.OptionParser()
+optp.add_option('-r', '--repeats', dest='repeats', type='int', default=5,
+                help='Number of times to time each run, the best is kept')
+(opts, args) = optp.parse_args()
+
+
+# the predicates as they were before charBlockKeys, each scanning and
+# slicing the field on its own
+def oneGramFingerprint(field):
+    return (u''.join(sorted(set(ngrams(field.replace(' ', ''), 1)))).strip(),)
+
+
+def twoGramFingerprint(field):
+    if len(field) > 1:
+        return (u''.join(sorted(gram.strip() for gram
+                                in set(ngrams(field.replace(' ', ''), 2)))),)
+    else:
+        return ()
+
+
+def commonFourGram(field):
+    return set(ngrams(field.replace(' ', ''), 4))
+
+
+def commonSixGram(field):
+    return set(ngrams(field.replace(' ', ''), 6))
+
+
+def sameThreeCharStartPredicate(field):
+    return initials(field.replace(' ', ''), 3)
+
+
+def sameFiveCharStartPredicate(field):
+    return initials(field.replace(' ', ''), 5)
+
+
+def sameSevenCharStartPredicate(field):
+    return initials(field.replace(' ', ''), 7)
+
+
+def suffixArray(field):
+    field = field.replace(' ', '')
+    n = len(field) - 4
+    if n > 0:
+        for i in range(0, n):
+            yield field[i:]
+
+
+separate = (oneGramFingerprint, twoGramFingerprint,
+            commonFourGram, commonSixGram,
+            sameThreeCharStartPredicate, sameFiveCharStartPredicate,
+            sameSevenCharStartPredicate, suffixArray)
+
+kernel = tuple(getattr(dedupe.predicates, func.__name__)
+               for func in separate)
+
+
+def restaurantRecords():
+    with open('tests/datasets/restaurant-nophone.csv') as f:
+        reader = csv.DictReader(f, skipinitialspace=True)
+        return [{k: exampleIO.preProcess(v) for k, v in row.items()}
+                for row in reader]
+
+
+def blockRecords(predicates, records):
+    return [[key for predicate in predicates
+             for key in predicate(record)]
+            for record in records]
+
+
+def timeBlocking(funcs, records, fields):
+    predicates = [StringPredicate(func, field)
+                  for field in fields for func in funcs]
+
+    best = float('inf')
+    for _ in range(opts.repeats):
+        dedupe.predicates.normalize.cache_clear()
+        dedupe.predicates.charKeys.cache_clear()
+        t0 = time.perf_counter()
+        keys = blockRecords(predicates, records)
+        best = min(best, time.perf_counter() - t0)
+
+    return keys, best
+
+
+records = restaurantRecords()
+fields = ('name', 'address', 'city', 'cuisine')
+print('restaurant %d records, %d fields, %d predicates per field\n' %
+      (len(records), len(fields), len(separate)))
+
+separate_keys, separate_time = timeBlocking(separate, records, fields)
+kernel_keys, kernel_time = timeBlocking(kernel, records, fields)
+
+print('%16s%16s' % ('', 'us per record'))
+print('%16s%16.1f' % ('separate', separate_time / len(records) * 1e6))
+print('%16s%16.1f' % ('charBlockKeys', kernel_time / len(records) * 1e6))
+print('\nspeedup %.2fx' % (separate_time / kernel_time))
+
+n_same = sum(sorted(a) == sorted(b)
+             for a, b in zip(separate_keys, kernel_keys))
+print('same keys for %d of %d records' % (n_same, len(records)))
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Times building and searching the zope based TfIdfIndex and the numpy
+CsrTfIdfIndex, on the restaurant datasets and on a synthetic corpus,
+and checks that they find the same docs.
+
+    python tests/benchmark_tfidf_index.py --docs 1000000
+"""
+import csv
+import itertools
+import optparse
+import random
+import time
+
+import exampleIO
+
+import dedupe
+from dedupe.predicates import TfidfNGramPredicate, TfidfTextPredicate
+
+
+optp = optparse.OptionParser()
+optp.add_option('-d', '--docs', dest='n_docs', type='int', default=1000000,
+                help='Number of docs in the synthetic corpus')
+optp.add_option('-q', '--queries', dest='n_queries', type='int',
+                default=10000,
+                help='Number of docs to search for in the synthetic corpus')
+optp.add_option('-t', '--threshold', dest='threshold', type='float',
+                default=0.6)
+(opts, args) = optp.parse_args()
+
+
+def restaurantDocs(preprocess):
+    docs = []
+    for filename in ('tests/datasets/restaurant-1.csv',
+                     'tests/datasets/restaurant-2.csv'):
+        with open(filename) as f:
+            reader = csv.DictReader(f, skipinitialspace=True)
+            for row in reader:
+                for field in ('name', 'address'):
+                    value = exampleIO.preProcess(row[field])
+                    if value:
+                        docs.append(preprocess(value))
+    return docs
+
+
+def syntheticDocs(n_docs, vocabulary_size=100000, seed=1):
+    rng = random.Random(seed)
+    # a zipfian vocabulary, so that some terms are very common
+    vocabulary = ['w%d' % i for i in range(vocabulary_size)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1)
+                                            for rank
+                                            in range(vocabulary_size)))
+    return [tuple(rng.choices(vocabulary, cum_weights=cum_weights,
+                              k=rng.randint(2, 6)))
+            for _ in range(n_docs)]
+
+
+def timeIndex(index_class, docs, queries, threshold):
+    t0 = time.perf_counter()
+    index = index_class()
+    for doc in docs:
+        index.index(doc)
+    index.initSearch()
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    results = [index.search(query, threshold) for query in queries]
+    search = time.perf_counter() - t0
+
+    if hasattr(index, 'searchMany'):
+        t0 = time.perf_counter()
+        batch_results = []
+        for i in range(0, len(queries), 1000):
+            batch_results.extend(index.searchMany(queries[i:i + 1000],
+                                                  threshold))
+        batch = time.perf_counter() - t0
+        assert batch_results == results
+    else:
+        batch = float('nan')
+
+    return results, (build, search, batch)
+
+
+def benchmark(name, docs, queries, threshold):
+    print(name, '%d docs, %d queries' % (len(docs), len(queries)))
+    print('%16s' % 'index' +
+          ''.join('%12s' % column for column in ('build', 'search', 'batch')))
+
+    all_results = []
+    for index_class in (dedupe.tfidf.TfIdfIndex, dedupe.tfidf.CsrTfIdfIndex):
+        results, timings = timeIndex(index_class, docs, queries, threshold)
+        all_results.append(results)
+        print('%16s' % index_class.__name__ +
+              ''.join('%12.3f' % timing for timing in timings))
+
+    n_same = sum(set(zope) == set(csr) for zope, csr in zip(*all_results))
+    print('same matches for %d of %d queries\n' % (n_same, len(queries)))
+
+
+restaurant_text = restaurantDocs(TfidfTextPredicate().preprocess)
+benchmark('restaurant words', restaurant_text, restaurant_text,
+          opts.threshold)
+
+restaurant_ngrams = restaurantDocs(TfidfNGramPredicate().preprocess)
+benchmark('restaurant ngrams', restaurant_ngrams, restaurant_ngrams,
+          opts.threshold)
+
+synthetic = syntheticDocs(opts.n_docs)
+benchmark('synthetic', synthetic, synthetic[:opts.n_queries], opts.threshold)
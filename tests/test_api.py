@@ -1,10 +1,14 @@
 import dedupe
 import unittest
 import itertools
+import io
+import os
 import random
+import tempfile
 import numpy
 import warnings
 from collections import OrderedDict
+from unittest import mock
 
 
 def icfi(x):
@@ -134,6 +138,189 @@ class DedupeTest(unittest.TestCase):
         for pair in correct_result:
             assert pair in self.deduper.active_learner.candidates
 
+    def test_block_data_modes(self):
+        predicates = dedupe.predicates
+        self.deduper.blocker = dedupe.blocking.Blocker(
+            [predicates.SimplePredicate(predicates.sameThreeCharStartPredicate,
+                                        'name'),
+             predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        'age'),
+             predicates.SimplePredicate(predicates.firstTokenPredicate,
+                                        'name')])
+
+        def comparedPairs():
+            pairs = []
+            for block in self.deduper._blockData(data_dict):
+                for (id_1, _, smaller_1), (id_2, _, smaller_2) in \
+                        itertools.combinations(sorted(block), 2):
+                    if smaller_1.isdisjoint(smaller_2):
+                        pairs.append((id_1, id_2))
+            return sorted(pairs)
+
+        pairs = comparedPairs()
+        assert pairs
+
+        self.deduper.compact_blocks = True
+        compact_pairs = comparedPairs()
+
+        assert compact_pairs == pairs
+        assert len(set(compact_pairs)) == len(compact_pairs)
+
+        self.deduper.compact_blocks = False
+        self.deduper.blocking_buffer_size = 2
+        external_pairs = comparedPairs()
+
+        assert external_pairs == pairs
+
+        self.deduper.blocker.hash_keys = True
+        hashed_pairs = comparedPairs()
+
+        assert hashed_pairs == pairs
+
+    def test_max_block_size(self):
+        predicates = dedupe.predicates
+        self.deduper.blocker = dedupe.blocking.Blocker(
+            [predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        'name'),
+             predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        'age')])
+
+        data = {i: {'name': name, 'age': age}
+                for i, (name, age)
+                in enumerate([('Bob', '1'), ('Bob', '1'), ('Bob', '2'),
+                              ('Bob', '2'), ('Sue', '2'), ('Sue', '2')])}
+
+        self.deduper.max_block_size = 3
+        with self.assertLogs('dedupe.api', 'WARNING'):
+            blocks = list(self.deduper._blockData(data))
+
+        assert sorted(sorted(record_id for record_id, _, _ in block)
+                      for block in blocks) == [[0, 1], [2, 3], [4, 5]]
+
+        self.deduper.blocking_buffer_size = 2
+        with self.assertLogs('dedupe.api', 'WARNING'):
+            external_blocks = list(self.deduper._blockData(data))
+
+        assert sorted(sorted(record_id for record_id, _, _ in block)
+                      for block in external_blocks) == [[0, 1], [2, 3], [4, 5]]
+
+    def test_blocking_report(self):
+        predicates = dedupe.predicates
+        self.deduper.blocker = dedupe.blocking.Blocker(
+            [predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        'age'),
+             predicates.SimplePredicate(predicates.firstTokenPredicate,
+                                        'name')],
+            profile=True)
+
+        list(self.deduper._blockData(data_dict))
+        age_stats, name_stats = self.deduper.blockingReport(reset=True)
+
+        assert age_stats['records'] == age_stats['keys'] == 7
+        assert age_stats['block_sizes'] == {2: 1, 4: 1}
+        assert age_stats['pairs'] == 3 + 1
+        assert name_stats['block_sizes'] == {2: 1}
+
+        self.deduper.blocking_buffer_size = 2
+        list(self.deduper._blockData(data_dict))
+        for stats, external_stats in zip([age_stats, name_stats],
+                                         self.deduper.blockingReport()):
+            del stats['seconds'], external_stats['seconds']
+            assert external_stats == stats
+
+    def test_prefilter(self):
+        self.deduper.classifier.weights = [-4.0, -4.0]
+        self.deduper.classifier.bias = 5.0
+        self.deduper.num_cores = 1
+
+        records = dict(data_dict)
+        records[7] = {'name': 'Bob', 'age': '51'}
+        blocks = [[(record_id, record, set())
+                   for record_id, record in records.items()]]
+
+        def comparedPairs():
+            distances = self.deduper.data_model.distances
+            with mock.patch.object(self.deduper.data_model, 'distances',
+                                   wraps=distances) as compare:
+                list(self.deduper.matchBlocks(blocks))
+            return sum(len(call_args[0][0])
+                       for call_args in compare.call_args_list)
+
+        all_pairs = comparedPairs()
+        assert all_pairs == 28
+
+        self.deduper.prefilter = True
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            assert comparedPairs() == all_pairs
+            assert "prefilter_threshold" in str(w[-1].message)
+
+        self.deduper.prefilter_threshold = 0.6
+        assert 0 < comparedPairs() < all_pairs
+
+    def test_move_index_directory(self):
+        predicates = dedupe.predicates
+        search = predicates.TfidfTextSearchPredicate(0.2, 'name')
+        canopy = predicates.TfidfTextCanopyPredicate(0.2, 'name')
+        for predicate in (search, canopy):
+            predicate.index_class = dedupe.tfidf.CsrTfIdfIndex
+        self.deduper.predicates = ((search,), (canopy,))
+        self.deduper.blocker = dedupe.blocking.Blocker(
+            self.deduper.predicates)
+        self.deduper.blocker.index(
+            [record['name'] for record in data_dict.values()], 'name')
+
+        def blockKeys(predicates):
+            return [[predicate(record) for (predicate,) in predicates]
+                    for record in data_dict.values()]
+
+        expected = blockKeys(self.deduper.predicates)
+
+        settings = io.BytesIO()
+        with tempfile.TemporaryDirectory() as directory:
+            written = os.path.join(directory, 'written')
+            moved = os.path.join(directory, 'moved')
+            self.deduper.writeSettings(settings, index=True,
+                                       index_directory=written)
+            os.rename(written, moved)
+
+            settings.seek(0)
+            static = dedupe.StaticDedupe(settings, index_directory=moved)
+            (loaded_search,), (loaded_canopy,) = static.predicates
+            assert isinstance(loaded_search.index,
+                              dedupe.mmap_index.MmapTfIdfIndex)
+            for predicate in (loaded_search, loaded_canopy):
+                assert os.path.dirname(predicate.index.directory) == moved
+            assert blockKeys(static.predicates) == expected
+
+    def test_reuse_scoring_pool(self):
+        field_definition = [{'field': 'name', 'type': 'String'},
+                            {'field': 'age', 'type': 'String'}]
+        blocks = [[(record_id, record, set())
+                   for record_id, record in data_dict.items()]]
+
+        with mock.patch.object(dedupe.core, 'ScoringPool',
+                               wraps=dedupe.core.ScoringPool) as ScoringPool:
+            with dedupe.Dedupe(field_definition, num_cores=2,
+                               backend='thread') as deduper:
+                deduper.classifier.weights = [-4.0, -4.0]
+                deduper.classifier.bias = 5.0
+
+                list(deduper.matchBlocks(blocks))
+                pool = deduper._scoring_pool
+                list(deduper.matchBlocks(blocks))
+
+                assert pool is not None
+                assert deduper._scoring_pool is pool
+                assert ScoringPool.call_count == 1
+
+        assert deduper._scoring_pool is None
+        assert pool._pool is None
+
+        deduper.close()
+        deduper.close()
+        assert deduper._scoring_pool is None
+
 
 class LinkTest(unittest.TestCase):
     def setUp(self):
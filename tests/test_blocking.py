@@ -1,6 +1,7 @@
 import dedupe
-from collections import defaultdict
+from collections import defaultdict, Counter
 import unittest
+from unittest import mock
 
 from future.utils import viewitems, viewvalues
 
@@ -71,6 +72,289 @@ class TfidfTest(unittest.TestCase):
         assert blocks ==\
             set([frozenset([120, 125]), frozenset([130, 135])])
 
+    def test_parallel_blocking(self):
+        predicates = dedupe.predicates
+        blocker = dedupe.blocking.Blocker(
+            [predicates.TfidfTextSearchPredicate(0.0, "name"),
+             predicates.TfidfNGramCanopyPredicate(0.2, "name"),
+             predicates.SimplePredicate(predicates.sameThreeCharStartPredicate,
+                                        "name"),
+             predicates.CompoundPredicate(
+                 (predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                             "age"),
+                  predicates.TfidfTextSearchPredicate(0.0, "name")))])
+        blocker.indexAll(self.data_d)
+
+        blocker.num_cores = 2
+        parallel_blocks = list(blocker(self.data_d.items()))
+
+        blocker.num_cores = 1
+        serial_blocks = list(blocker(self.data_d.items()))
+
+        assert sorted(parallel_blocks) == sorted(serial_blocks)
+        assert ([record_id for _, record_id in parallel_blocks] ==
+                [record_id for _, record_id in serial_blocks])
+
+        blocker.hash_keys = True
+        hashed_blocks = list(blocker(self.data_d.items()))
+
+        assert hashed_blocks == [(dedupe.blocking.hashBlockKey(block_key),
+                                  record_id)
+                                 for block_key, record_id in serial_blocks]
+        assert all(hashed_key >> 64 == int(block_key.rsplit(':', 1)[1])
+                   for (hashed_key, _), (block_key, _)
+                   in zip(hashed_blocks, serial_blocks))
+
+    def test_parallel_index(self):
+        def buildBlocker():
+            predicates = dedupe.predicates
+            return dedupe.blocking.Blocker(
+                [predicates.TfidfTextSearchPredicate(0.0, "name"),
+                 predicates.TfidfNGramSearchPredicate(0.5, "name"),
+                 predicates.LevenshteinSearchPredicate(1, "name"),
+                 predicates.TfidfNGramSearchPredicate(0.5, "age")],
+                num_cores=2)
+
+        data_d = dict(self.data_d)
+        data_d[150] = {"name": "Kyle Bob", "age": "27", "dataset": 1}
+
+        serial = buildBlocker()
+        serial.num_cores = 1
+        serial.indexAll(data_d)
+
+        parallel = buildBlocker()
+        parallel._parallelIndexAll(data_d, min_shard_size=2)
+
+        assert sorted(parallel(data_d.items())) == \
+            sorted(serial(data_d.items()))
+
+        tfidf_index = parallel.predicates[0].index
+        assert tfidf_index.search(("Kyle", "Bob"), 0.5) == \
+            serial.predicates[0].index.search(("Kyle", "Bob"), 0.5)
+
+        new_data = {160: {"name": "Bob Kyle", "age": "50", "dataset": 0}}
+        parallel._parallelIndexAll(new_data, min_shard_size=2)
+        serial.indexAll(new_data)
+        assert tfidf_index.search(("Bob",), 0.5) == \
+            serial.predicates[0].index.search(("Bob",), 0.5)
+
+    def test_search_many(self):
+        predicates = dedupe.predicates
+
+        def buildBlocker():
+            blocker = dedupe.blocking.Blocker(
+                [predicates.TfidfTextSearchPredicate(0.0, "name"),
+                 predicates.TfidfNGramCanopyPredicate(0.2, "name"),
+                 predicates.LevenshteinSearchPredicate(2, "name")])
+            blocker.indexAll(self.data_d)
+            return blocker
+
+        one_at_a_time = buildBlocker()
+        expected = [(block_key, record_id)
+                    for record_id, record in self.data_d.items()
+                    for pred_id, predicate
+                    in enumerate(one_at_a_time.predicates)
+                    for block_key in [key + ':' + str(pred_id)
+                                      for key in predicate(record)]]
+
+        blocker = buildBlocker()
+        searches = []
+
+        def countedSearch(search):
+            def wrapper(*args):
+                searches.append(args)
+                return search(*args)
+            return wrapper
+
+        for predicate in blocker.predicates:
+            predicate.index.search = countedSearch(predicate.index.search)
+
+        assert list(blocker._blocks(self.data_d.items(),
+                                    [(':' + str(i), predicate)
+                                     for i, predicate
+                                     in enumerate(blocker.predicates)],
+                                    False, None, chunk_size=4)) == \
+            [(record_id, [block_key for block_key, key_record_id in expected
+                          if key_record_id == record_id])
+             for record_id in self.data_d]
+        assert searches == []
+
+        for predicate in blocker.predicates:
+            docs = [predicate.preprocess(record["name"])
+                    for record in self.data_d.values()]
+            assert predicate.index.searchMany(docs, predicate.threshold) == \
+                [predicate.index.search(doc, predicate.threshold)
+                 for doc in docs]
+
+    def test_csr_index(self):
+        predicates = dedupe.predicates
+        csr_predicate = predicates.TfidfTextSearchPredicate(0.0, "name")
+        csr_predicate.index_class = dedupe.tfidf.CsrTfIdfIndex
+
+        blocker = dedupe.blocking.Blocker(
+            [predicates.TfidfTextSearchPredicate(0.0, "name"), csr_predicate])
+        blocker.indexAll(self.data_d)
+
+        default_index, csr_index = [predicate.index
+                                    for predicate in blocker.predicates]
+        assert isinstance(default_index, dedupe.tfidf.TfIdfIndex)
+        assert isinstance(csr_index, dedupe.tfidf.CsrTfIdfIndex)
+
+        blocks = defaultdict(set)
+        for block_key, record_id in blocker(self.data_d.items()):
+            blocks[block_key[block_key.rindex(':'):]].add(
+                (block_key[:block_key.rindex(':')], record_id))
+
+        assert blocks[':0'] == blocks[':1']
+
+    def test_profile(self):
+        predicates = dedupe.predicates
+        blocker = dedupe.blocking.Blocker(
+            [predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        "dataset"),
+             predicates.SimplePredicate(predicates.sameThreeCharStartPredicate,
+                                        "name")],
+            profile=True)
+
+        data_d = {record_id: dict(record, dataset=str(record["dataset"]))
+                  for record_id, record in self.data_d.items()}
+        blocks = defaultdict(list)
+        for block_key, record_id in blocker(data_d.items()):
+            blocks[block_key].append(record_id)
+        blocker.profile.countBlocks(blocks)
+
+        dataset_stats, name_stats = blocker.profile.report()
+
+        assert dataset_stats['predicate'] == '(wholeFieldPredicate, dataset)'
+        assert dataset_stats['records'] == 10
+        assert dataset_stats['keys'] == 10
+        assert dataset_stats['blocks'] == 2
+        assert dataset_stats['max_block_size'] == 6
+        assert dataset_stats['pairs'] == 15 + 6
+        assert dataset_stats['block_sizes'] == {4: 1, 8: 1}
+
+        assert name_stats['blocks'] == 2
+        assert name_stats['pairs'] == 2
+        assert name_stats['block_sizes'] == {2: 2}
+
+        blocker.profile.reset()
+        assert blocker.profile.report()[0]['keys'] == 0
+
+    def test_hash_collisions(self):
+        predicates = dedupe.predicates
+        blocker = dedupe.blocking.Blocker(
+            [predicates.StringPredicate(predicates.commonFourGram, "name"),
+             predicates.SimplePredicate(predicates.wholeFieldPredicate,
+                                        "name")],
+            hash_keys=True)
+
+        # every key of a predicate collides, including the four-grams
+        # of one name
+        with mock.patch.object(dedupe.blocking, 'hashKey', return_value=7):
+            hashed_blocks = list(blocker(self.data_d.items()))
+
+        expected = []
+        for record_id, record in self.data_d.items():
+            if len(record["name"]) >= 4:
+                expected.append((7, record_id))
+            expected.append((1 << 64 | 7, record_id))
+
+        assert hashed_blocks == expected
+
+
+class SplitBlocksTest(unittest.TestCase):
+    def test_recursive_split(self):
+        oversized = {'a': [0, 1, 2, 3, 4, 5],
+                     'b': [0, 1, 2, 3, 4, 5],
+                     'c': [0, 1, 2, 7]}
+
+        sub_blocks, dropped, lost_pairs = dedupe.blocking.splitBlocks(
+            oversized, 3)
+
+        assert sub_blocks == {'a&b&c': [0, 1, 2],
+                              'a&c': [0, 1, 2],
+                              'b&c': [0, 1, 2]}
+        assert dropped == 0
+        assert lost_pairs == (15 - 6) + (15 - 6)
+
+    def test_unsplittable(self):
+        oversized = {'a': [0, 1, 2, 3], 'b': [0, 1, 2, 3], 'c': [4, 5, 6, 7]}
+
+        sub_blocks, dropped, lost_pairs = dedupe.blocking.splitBlocks(
+            oversized, 3)
+
+        assert sub_blocks == {}
+        assert dropped == 1
+        assert lost_pairs == 6 * 3
+
+
+class SortedNeighborhoodTest(unittest.TestCase):
+    def setUp(self):
+        names = ["Bob", "Bobby", "Bobbie", "Rob", "Robert", "Roberta",
+                 "Robin", "Sue", "Susan", "Suzy", "Suzanne"]
+        self.data_d = {i: {"name": name} for i, name in enumerate(names)}
+        self.data_d[11] = {"name": "Bob"}
+
+    def test_windows(self):
+        predicate = dedupe.predicates.SortedNeighborhoodPredicate(0.35,
+                                                                  "name")
+        blocker = dedupe.blocking.Blocker([predicate])
+        blocker.indexAll(self.data_d)
+
+        blocks = defaultdict(set)
+        for block_key, record_id in blocker(self.data_d.items()):
+            blocks[block_key].add(self.data_d[record_id]["name"])
+
+        assert all(len(block) <= 4 for block in blocks.values())
+        assert {"Rob", "Robert"} <= blocks["1:0"]
+        assert any({"Suzanne", "Suzy"} <= block for block in blocks.values())
+        assert blocks["0:0"] == {"Bob", "Bobbie", "Bobby", "Rob"}
+
+        assert predicate({"name": "Bobo"}) == ["0", "1"]
+        assert predicate({"name": "Zed"}) == ["4", "5"]
+        assert predicate({"name": ""}) == ()
+
+        predicate.freeze(self.data_d.values())
+        assert predicate.index is None
+        assert predicate({"name": "Robin"}) == ["2", "3"]
+
+    def test_reversed(self):
+        predicate = dedupe.predicates.ReversedSortedNeighborhoodPredicate(
+            0.15, "name")
+        blocker = dedupe.blocking.Blocker([predicate])
+        blocker.indexAll(self.data_d)
+
+        assert set(predicate({"name": "Bobbie"})) & \
+            set(predicate({"name": "Robbie"}))
+        assert not set(predicate({"name": "Bobbie"})) & \
+            set(predicate({"name": "Bobby"}))
+
+    def test_window_scales(self):
+        index = dedupe.neighborhood.SortedNeighborhoodIndex()
+
+        def blockSizes(n_docs):
+            for i in range(n_docs):
+                index.index("%05d" % i)
+            index.initSearch()
+
+            blocks = Counter(window
+                             for i in range(n_docs)
+                             for window in index.search("%05d" % i, 0.1))
+            return set(blocks.values())
+
+        assert blockSizes(100) == {5, 10}
+        assert blockSizes(1000) == {50, 100}
+
+    def test_data_model(self):
+        data_model = dedupe.Dedupe([{"field": "name",
+                                     "type": "String",
+                                     "neighborhood windows": [0.01]}]).data_model
+        for canopies in (True, False):
+            assert any(isinstance(predicate,
+                                  dedupe.predicates.SortedNeighborhoodPredicate)
+                       for predicate
+                       in data_model.predicates(canopies=canopies))
+
 
 class TfIndexUnindex(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,41 @@
+import unittest
+
+import numpy
+
+from dedupe.variables.categorical_type import CategoricalType
+from dedupe.variables.exists import ExistsType
+
+
+class TestCategorical(unittest.TestCase):
+    def setUp(self):
+        self.variable = CategoricalType({'field': 'type',
+                                         'type': 'Categorical',
+                                         'categories': ['a', 'b', 'c']})
+
+    def test_column_comparator(self):
+        column_1 = ['a', 'a', 'b', 'c', 'c', 'b']
+        column_2 = ['a', 'b', 'c', 'a', 'c', 'b']
+
+        numpy.testing.assert_array_almost_equal(
+            self.variable.column_comparator(column_1, column_2),
+            [self.variable.comparator(value_1, value_2)
+             for value_1, value_2 in zip(column_1, column_2)])
+
+    def test_undeclared_category(self):
+        self.assertRaises(ValueError,
+                          self.variable.comparator, 'a', 'd')
+        self.assertRaises(ValueError,
+                          self.variable.column_comparator, ['a'], ['d'])
+
+
+class TestExists(unittest.TestCase):
+    def test_column_comparator(self):
+        variable = ExistsType({'field': 'phone', 'type': 'Exists'})
+
+        column_1 = ['555', '555', None, None, '', 0]
+        column_2 = ['556', None, '556', None, '556', 0]
+
+        numpy.testing.assert_array_almost_equal(
+            variable.column_comparator(column_1, column_2),
+            [variable.comparator(value_1, value_2)
+             for value_1, value_2 in zip(column_1, column_2)])
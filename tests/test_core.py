@@ -1,6 +1,10 @@
 import unittest
 import random
+import itertools
 import sys
+import os
+import queue
+from unittest import mock
 
 import numpy
 
@@ -97,6 +101,341 @@ class ScoreDuplicates(unittest.TestCase):
         numpy.testing.assert_allclose(scores['score'],
                                       self.desired_scored_pairs['score'], 2)
 
+    def test_score_duplicates_interned(self):
+        scores = dedupe.core.scoreDuplicates(self.records,
+                                             self.data_model,
+                                             self.classifier,
+                                             2,
+                                             intern_records=True)
+
+        numpy.testing.assert_equal(scores['pairs'],
+                                   self.desired_scored_pairs['pairs'])
+
+        numpy.testing.assert_allclose(scores['score'],
+                                      self.desired_scored_pairs['score'], 2)
+
+    def test_score_duplicates_pool(self):
+        records = list(self.records)
+        with dedupe.core.ScoringPool(2, self.data_model,
+                                     self.classifier) as pool:
+            for _ in range(2):
+                scores = dedupe.core.scoreDuplicates(iter(records),
+                                                     self.data_model,
+                                                     self.classifier,
+                                                     2,
+                                                     pool=pool)
+
+                numpy.testing.assert_equal(scores['pairs'],
+                                           self.desired_scored_pairs['pairs'])
+
+    def test_score_duplicates_backends(self):
+        records = list(self.records)
+        for backend in ('thread', 'serial', 'process'):
+            scores = dedupe.core.scoreDuplicates(iter(records),
+                                                 self.data_model,
+                                                 self.classifier,
+                                                 2,
+                                                 backend=backend)
+
+            numpy.testing.assert_equal(scores['pairs'],
+                                       self.desired_scored_pairs['pairs'])
+
+        with self.assertRaises(ValueError):
+            dedupe.core.ScoringPool(2, self.data_model, self.classifier,
+                                    backend='gpu')
+
+    def test_record_store(self):
+        store = dedupe.core.RecordStore()
+        record_pairs = [(('1', {'name': 'Marga'}, {'a'}),
+                         ('2', {'name': 'Maria'}, set())),
+                        (('1', {'name': 'Marga'}, {'a'}),
+                         ('3', {'name': 'Mira'}, {'a'}))]
+
+        chunk = store.pack(tuple(store.internPairs(record_pairs)))
+        assert chunk.shape == (1, 4)
+
+        reader = dedupe.core.RecordReader(store.file_path)
+        offset_1, length_1, offset_2, length_2 = chunk[0]
+        assert reader.read(offset_1, length_1) == ('1', {'name': 'Marga'})
+        assert reader.read(offset_2, length_2) == ('2', {'name': 'Maria'})
+
+        reader.close()
+        store.close()
+        assert not os.path.exists(store.file_path)
+
+    def test_record_store_same_data(self):
+        records = {'1': {'name': 'Marga'},
+                   '2': {'name': 'Maria'},
+                   '3': {'name': 'Mira'}}
+        record_pairs = [((id_1, records[id_1], set()),
+                         (id_2, records[id_2], set()))
+                        for id_1, id_2 in (('1', '2'), ('2', '3'), ('1', '3'))]
+
+        linked_store = dedupe.core.RecordStore()
+        list(linked_store.internPairs(record_pairs))
+
+        store = dedupe.core.RecordStore(same_data=True)
+        chunk = store.pack(tuple(store.internPairs(record_pairs)))
+        assert len(store._locations) == 3 < len(linked_store._locations)
+
+        reader = dedupe.core.RecordReader(store.file_path)
+        offset_1, length_1, offset_2, length_2 = chunk[1]
+        assert reader.read(offset_1, length_1) == ('2', records['2'])
+        assert reader.read(offset_2, length_2) == ('3', records['3'])
+
+        reader.close()
+        store.close()
+        linked_store.close()
+
+    def test_record_store_removed_on_error(self):
+        class BrokenClassifier(object):
+            def predict_proba(self, distances):
+                raise ValueError('broken')
+
+        stores = []
+        RecordStore = dedupe.core.RecordStore
+
+        def recordStore(*args):
+            stores.append(RecordStore(*args))
+            return stores[-1]
+
+        records = list(self.records)
+        with mock.patch.object(dedupe.core, 'RecordStore', recordStore):
+            with self.assertRaises(ValueError):
+                dedupe.core.scoreDuplicates(iter(records),
+                                            self.data_model,
+                                            BrokenClassifier(),
+                                            intern_records=True,
+                                            backend='serial')
+            with self.assertRaises(dedupe.core.ChildProcessError):
+                dedupe.core.scoreDuplicates(iter(records),
+                                            self.data_model,
+                                            BrokenClassifier(),
+                                            intern_records=True)
+
+        assert len(stores) == 2
+        for store in stores:
+            assert not os.path.exists(store.file_path)
+
+
+class InternIdsTest(unittest.TestCase):
+    def test_intern_ids(self):
+        record_pairs = [(('b', {}, set()), ('a', {}, set())),
+                        (('a', {}, set()), ('c', {}, set()))]
+
+        id_index = dedupe.core.Enumerator()
+        interned = list(dedupe.core.internIds(record_pairs, id_index))
+
+        assert [(pair[0][0], pair[1][0]) for pair in interned] == [(0, 1),
+                                                                   (1, 2)]
+        assert list(id_index) == ['b', 'a', 'c']
+
+
+class ExternalSortTest(unittest.TestCase):
+    def test_external_sort(self):
+        random.seed(123)
+        items = [(random.randint(0, 10), str(i)) for i in range(50)]
+
+        assert list(dedupe.core.externalSort(iter(items), 7)) == sorted(items)
+        assert list(dedupe.core.externalSort([], 7)) == []
+
+        key = lambda item: item[0]  # noqa: E731
+        sorted_items = dedupe.core.externalSort(items, 7, key=key)
+        assert [key(item) for item in sorted_items] == sorted(map(key, items))
+
+
+class FillQueueTest(unittest.TestCase):
+    def test_chunk_sizer(self):
+        stats = []
+        chunk_sizer = dedupe.core.ChunkSizer(chunk_size=10,
+                                             retune_every=2,
+                                             stats_callback=stats.append)
+
+        records_queue = queue.Queue()
+        dedupe.core.fillQueue(records_queue, range(1000), 1,
+                              chunk_sizer=chunk_sizer)
+
+        chunks = []
+        while True:
+            chunk = records_queue.get()
+            if chunk is None:
+                break
+            chunks.append(chunk)
+
+        assert sum(chunks, ()) == tuple(range(1000))
+        assert len(stats) == len(chunks) // 2
+        assert set(stats[0]) == {'chunk_size', 'rate',
+                                 'queue_wait', 'bytes_per_pair'}
+
+    def test_max_chunk_bytes(self):
+        chunk_sizer = dedupe.core.ChunkSizer(chunk_size=10000,
+                                             max_chunk_bytes=3200)
+        chunk_sizer.start()
+        chunk_sizer.update(numpy.zeros((10000, 4), dtype='u8'), 0)
+
+        assert chunk_sizer.chunk_size == 100
+
+
+class ScoredPairsFileTest(unittest.TestCase):
+    def test_append(self):
+        dtype = numpy.dtype([('pairs', int, 2), ('score', 'f4')])
+        chunk_1 = numpy.array([((1, 2), 0.5), ((1, 3), 0.7)], dtype=dtype)
+        chunk_2 = numpy.array([((4, 5), 0.9)], dtype=dtype)
+
+        scored_pairs_file = dedupe.core.ScoredPairsFile()
+        scored_pairs_file.append(chunk_1)
+        scored_pairs_file.append(chunk_2)
+        scored_pairs_file.close()
+
+        assert scored_pairs_file.size == 3
+
+        scored_pairs = numpy.memmap(scored_pairs_file.file_path,
+                                    dtype=scored_pairs_file.dtype,
+                                    shape=(scored_pairs_file.size,))
+
+        numpy.testing.assert_equal(scored_pairs,
+                                   numpy.concatenate((chunk_1, chunk_2)))
+
+        del scored_pairs
+        scored_pairs_file.remove()
+
+
+class ScoreGazetteTest(unittest.TestCase):
+    def setUp(self):
+        deduper = dedupe.Dedupe([{'field': "name", 'type': 'String'}])
+        self.data_model = deduper.data_model
+        self.classifier = deduper.classifier
+        self.classifier.weights = [-1.0302742719650269]
+        self.classifier.bias = 4.76
+
+        messy = (1, {'name': 'Marga'}, set())
+        self.block = [(messy, (i, {'name': name}, set()))
+                      for i, name in enumerate(['Margret', 'Marga', 'Maria',
+                                                'Monica', 'Mira', 'Mona'])]
+
+    def test_pool(self):
+        score_block = dedupe.core.ScoreGazette(self.data_model,
+                                               self.classifier,
+                                               0,
+                                               n_matches=2)
+        with dedupe.core.ScoringPool(2, self.data_model,
+                                     self.classifier) as pool:
+            scored_blocks = list(dedupe.core.scoreGazette([self.block] * 2,
+                                                          self.data_model,
+                                                          self.classifier,
+                                                          threshold=0,
+                                                          n_matches=2,
+                                                          pool=pool))
+
+        assert len(scored_blocks) == 2
+        for scored_block in scored_blocks:
+            numpy.testing.assert_equal(scored_block, score_block(self.block))
+
+    def test_backends(self):
+        for backend in ('thread', 'serial'):
+            scored_blocks = list(dedupe.core.scoreGazette([self.block] * 3,
+                                                          self.data_model,
+                                                          self.classifier,
+                                                          2,
+                                                          n_matches=2,
+                                                          backend=backend))
+            assert len(scored_blocks) == 3
+
+    def test_top_scores(self):
+        dtype = [('pairs', int, 2), ('score', 'f4')]
+        scored_pairs = numpy.array([((1, 2), 0.5),
+                                    ((1, 3), 0.9),
+                                    ((1, 4), 0.7),
+                                    ((1, 5), 0.7),
+                                    ((1, 6), 0.1)], dtype=dtype)
+
+        top = dedupe.core.topScores(scored_pairs, 2)
+        assert sorted(top['pairs'][:, 1]) == [3, 4, 5]
+
+        assert len(dedupe.core.topScores(scored_pairs, 0)) == 5
+
+    def test_chunked_top_scores(self):
+        score_all = dedupe.core.ScoreGazette(self.data_model,
+                                             self.classifier,
+                                             0)
+        score_top = dedupe.core.ScoreGazette(self.data_model,
+                                             self.classifier,
+                                             0,
+                                             n_matches=2,
+                                             chunk_size=2)
+
+        all_pairs = score_all(self.block)
+        top_pairs = score_top(self.block)
+
+        assert len(top_pairs) < len(all_pairs)
+
+        gazetteMatching = dedupe.clustering.gazetteMatching
+        numpy.testing.assert_equal(list(gazetteMatching([top_pairs], 2)),
+                                   list(gazetteMatching([all_pairs], 2)))
+
+
+class PrefilterTest(unittest.TestCase):
+    def setUp(self):
+        fields = [{'field': 'name', 'variable name': 'name',
+                   'type': 'String'},
+                  {'field': 'city', 'variable name': 'city',
+                   'type': 'Exact', 'has missing': True},
+                  {'field': 'address', 'variable name': 'address',
+                   'type': 'Text', 'has missing': True},
+                  {'type': 'Interaction',
+                   'interaction variables': ['city', 'address']}]
+        self.data_model = dedupe.datamodel.DataModel(fields)
+        self.classifier = dedupe.Dedupe(fields).classifier
+        self.classifier.weights = [-0.5, 4.0, 1.0, 1.0, 0.5, -0.5, 0.0]
+        self.classifier.bias = -2.5
+
+        names = ['Marga', 'Margret', 'Maria', 'Mona']
+        cities = ['chicago', 'chicago', 'boston', None]
+        addresses = ['1 main st', '1 main street', None, '2 elm st']
+        records = [{'name': name, 'city': city, 'address': address}
+                   for name, city, address
+                   in itertools.product(names, cities, addresses)]
+
+        self.ids = list(itertools.combinations(range(len(records)), 2))
+        self.records = [(records[i], records[j]) for i, j in self.ids]
+
+    def test_bounds(self):
+        distances = self.data_model.distances(self.records)
+        lower, upper = self.data_model.distanceBounds(self.records)
+
+        assert (lower <= distances).all()
+        assert (distances <= upper).all()
+
+        # bounded by the lengths of the names, not just by 0
+        assert (lower[:, 0] >= 0.5).all()
+
+    def test_prefilter(self):
+        ids, records = dedupe.core.prefilterPairs(self.data_model,
+                                                  self.classifier,
+                                                  0.5,
+                                                  self.ids,
+                                                  self.records)
+        assert 0 < len(records) < len(self.records)
+
+        score = dedupe.core.ScoreDupes(self.data_model,
+                                       self.classifier,
+                                       0.5).score
+        prefiltered_score = dedupe.core.ScoreDupes(self.data_model,
+                                                   self.classifier,
+                                                   0.5,
+                                                   prefilter=True).score
+
+        numpy.testing.assert_equal(prefiltered_score(self.ids, self.records),
+                                   score(self.ids, self.records))
+
+    def test_no_weights(self):
+        ids, records = dedupe.core.prefilterPairs(self.data_model,
+                                                  object(),
+                                                  0.5,
+                                                  self.ids,
+                                                  self.records)
+        assert records is self.records
+
 
 class FieldDistances(unittest.TestCase):
 
@@ -149,6 +488,47 @@ class FieldDistances(unittest.TestCase):
                                                 numpy.array([[0, 1, 1, 0, 1],
                                                              [1, 0, 1, 1, 0]]), 3)
 
+    def test_column_comparators(self):
+        deduper = dedupe.Dedupe([{'field': 'price',
+                                  'type': 'Price',
+                                  'has missing': True},
+                                 {'field': 'location',
+                                  'type': 'LatLong',
+                                  'has missing': True},
+                                 {'field': 'phone',
+                                  'type': 'Exists'},
+                                 {'field': 'name',
+                                  'type': 'Exact'}])
+
+        record_pairs = (({'price': 10, 'location': (41.8, -87.6),
+                          'phone': '555', 'name': 'a'},
+                         {'price': 1000, 'location': (40.7, -74.0),
+                          'phone': None, 'name': 'a'}),
+                        ({'price': None, 'location': (41.8, -87.6),
+                          'phone': '555', 'name': 'a'},
+                         {'price': 5, 'location': None,
+                          'phone': '556', 'name': 'b'}),
+                        ({'price': -1, 'location': (41.8, -87.6),
+                          'phone': None, 'name': None},
+                         {'price': 5, 'location': (41.8, -87.6),
+                          'phone': None, 'name': 'b'}))
+
+        data_model = deduper.data_model
+        distances = data_model.distances(record_pairs)
+
+        expected = numpy.empty_like(distances)
+        for i, pair in enumerate(record_pairs):
+            for field, compare, start, stop in data_model._field_comparators:
+                value_1, value_2 = (record[field] for record in pair)
+                if ((value_1 is not None and value_2 is not None) or
+                        hasattr(compare, 'missing')):
+                    expected[i, start:stop] = compare(value_1, value_2)
+                else:
+                    expected[i, start:stop] = numpy.nan
+        expected = data_model._derivedDistances(expected)
+
+        numpy.testing.assert_array_almost_equal(distances, expected, 3)
+
 
 class Unique(unittest.TestCase):
 
@@ -73,6 +73,59 @@ class DataModelTest(unittest.TestCase):
 
         assert data_model._missing_field_indices == []
 
+    def test_neighborhood_windows(self):
+        def windows(definition):
+            data_model = dedupe.datamodel.DataModel([definition])
+            return sorted(
+                (type(predicate).__name__, predicate.threshold)
+                for predicate in data_model.predicates()
+                if isinstance(predicate,
+                              dedupe.predicates.SortedNeighborhoodPredicate))
+
+        assert windows({'field': 'a', 'type': 'String'}) == []
+
+        assert windows({'field': 'a', 'type': 'Text',
+                        'neighborhood windows': [0.001, 0.01]}) == \
+            [('ReversedSortedNeighborhoodPredicate', 0.001),
+             ('ReversedSortedNeighborhoodPredicate', 0.01),
+             ('SortedNeighborhoodPredicate', 0.001),
+             ('SortedNeighborhoodPredicate', 0.01)]
+
+    def test_tfidf_index(self):
+        def indexClasses(definition):
+            data_model = dedupe.datamodel.DataModel([definition])
+            return {predicate.index_class
+                    for predicate in data_model.predicates()
+                    if isinstance(predicate,
+                                  dedupe.predicates.TfidfPredicate)}
+
+        assert indexClasses({'field': 'a', 'type': 'String'}) == \
+            {dedupe.tfidf.TfIdfIndex}
+        assert indexClasses({'field': 'a', 'type': 'Text',
+                             'tfidf index': 'csr'}) == \
+            {dedupe.tfidf.CsrTfIdfIndex}
+
+        with self.assertRaises(ValueError):
+            dedupe.datamodel.DataModel([{'field': 'a', 'type': 'Set',
+                                         'tfidf index': 'scipy'}])
+
+    def test_lsh_thresholds(self):
+        def thresholds(definition):
+            data_model = dedupe.datamodel.DataModel([definition])
+            return sorted({predicate.threshold
+                           for predicate in data_model.predicates()
+                           if isinstance(predicate,
+                                         dedupe.predicates.LSHPredicate)})
+
+        assert thresholds({'field': 'a', 'type': 'String'}) == []
+        assert thresholds({'field': 'a', 'type': 'Set'}) == []
+        assert thresholds({'field': 'a', 'type': 'Text',
+                           'lsh thresholds': [0.4, 0.8]}) == [0.4, 0.8]
+        assert thresholds({'field': 'a', 'type': 'Set',
+                           'lsh thresholds': [0.6]}) == [0.6]
+        assert thresholds({'field': 'a', 'type': 'ShortString',
+                           'lsh thresholds': [0.6]}) == []
+
 
 class ConnectedComponentsTest(unittest.TestCase):
     def test_components(self):
@@ -188,6 +241,11 @@ class ClusteringTest(unittest.TestCase):
                                     (0.899,
                                      0.899))])
 
+        reversed_dupes = self.dupes.copy()
+        reversed_dupes['pairs'] = reversed_dupes['pairs'][:, ::-1]
+        assert self.clusterEquals(list(hierarchical(reversed_dupes, 0.5)),
+                                  list(hierarchical(self.dupes, 0.5)))
+
         assert list(hierarchical(self.str_dupes, 1)) == []
         assert list(zip(*hierarchical(self.str_dupes, 0.5)))[0] == ((b'1', b'2', b'3'),
                                                                     (b'4', b'5'))
@@ -0,0 +1,66 @@
+import dedupe
+import pickle
+import unittest
+
+
+class MinHashLSHTest(unittest.TestCase):
+    def setUp(self):
+        address = ('1060', 'w', 'addison', 'st', 'chicago', 'il',
+                   '60613', 'usa')
+        self.docs = [address,
+                     address[:3] + ('street',) + address[4:],
+                     address[:5] + ('illinois',) + address[6:],
+                     ('1', 'broadway', 'new', 'york', 'ny', '10004'),
+                     ()]
+        self.index = dedupe.lsh.MinHashLSH()
+        for doc in self.docs:
+            self.index.index(doc)
+        self.index.initSearch()
+
+    def test_search(self):
+        assert self.index.search(self.docs[0], 0.5) == [1, 2, 3]
+        assert self.index.search(self.docs[0], 0.9) == [1]
+        assert self.index.search(self.docs[3], 0.2) == [4]
+        assert self.index.search((), 0.2) == []
+        assert self.index.search(('nowhere',), 0.2) == []
+
+    def test_unindex(self):
+        self.index.search(self.docs[0], 0.5)
+        self.index.unindex(self.docs[1])
+        assert self.index.search(self.docs[0], 0.5) == [1, 3]
+
+        self.index.index(self.docs[1])
+        assert sorted(self.index.search(self.docs[0], 0.5)) == [1, 3, 6]
+
+    def test_bands_rows(self):
+        index = dedupe.lsh.MinHashLSH(bands=16, rows=8)
+        for doc in self.docs:
+            index.index(doc)
+
+        assert index.search(self.docs[0], 0.5) == [1, 2, 3]
+        self.assertRaises(ValueError, dedupe.lsh.MinHashLSH, bands=16)
+        self.assertRaises(ValueError, dedupe.lsh.MinHashLSH,
+                          bands=16, rows=16)
+
+    def test_pickle(self):
+        self.index.search(self.docs[0], 0.5)
+        loaded = pickle.loads(pickle.dumps(self.index))
+        assert loaded._tables == {}
+        assert loaded.search(self.docs[0], 0.5) == [1, 2, 3]
+
+    def test_predicate(self):
+        predicate = dedupe.predicates.LSHTextSearchPredicate(0.5, 'address')
+        predicate.index = predicate.initIndex()
+        for doc in self.docs:
+            predicate.index.index(doc)
+
+        record = {'address': '1060 W Addison St, Chicago, IL 60613, USA'}
+        assert predicate(record) == []
+
+        record['address'] = record['address'].lower()
+        assert predicate(record) == ['1', '2', '3']
+        assert predicate(record, target=True) == ['1']
+
+
+if __name__ == "__main__":
+    unittest.main()
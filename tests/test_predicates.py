@@ -9,6 +9,19 @@ class TestPuncStrip(unittest.TestCase):
                                         'foo')
         assert s1({'foo': u'fo,18v*1vaad80'}) == s1({'foo': u'fo18v1vaad80'})
 
+    def test_normalize_cache(self):
+        predicates.normalize.cache_clear()
+        record = {'foo': u'123 16th st., chicago'}
+        for predicate in (predicates.sameSevenCharStartPredicate,
+                          predicates.commonFourGram,
+                          predicates.firstTokenPredicate):
+            predicates.StringPredicate(predicate, 'foo')(record)
+
+        assert predicates.normalize(record['foo']) == u'123 16th st chicago'
+        info = predicates.normalize.cache_info()
+        assert info.misses == 1
+        assert info.hits == 3
+
     def test_set(self):
         s1 = predicates.SimplePredicate(predicates.wholeSetPredicate,
                                         'foo')
@@ -16,11 +29,56 @@ class TestPuncStrip(unittest.TestCase):
         assert s1({'foo': colors}) == (str(colors),)
 
 
+class TestCharBlockKeys(unittest.TestCase):
+    def test_char_block_keys(self):
+        field = u'de dupe'
+        assert predicates.oneGramFingerprint(field) == (u'depu',)
+        assert predicates.twoGramFingerprint(field) == (u'deduedpeup',)
+        assert predicates.commonFourGram(field) == {u'dedu', u'edup', u'dupe'}
+        assert predicates.commonSixGram(field) == {u'dedupe'}
+        assert predicates.sameThreeCharStartPredicate(field) == (u'ded',)
+        assert predicates.sameFiveCharStartPredicate(field) == (u'dedup',)
+        assert predicates.sameSevenCharStartPredicate(field) == (u'dedupe',)
+        assert list(predicates.suffixArray(field)) == [u'dedupe', u'edupe']
+
+    def test_short(self):
+        assert predicates.oneGramFingerprint(u'') == (u'',)
+        assert predicates.twoGramFingerprint(u'a') == ()
+        assert predicates.twoGramFingerprint(u'a b') == (u'ab',)
+        assert predicates.commonFourGram(u'abc') == set()
+        assert list(predicates.suffixArray(u'abcd')) == []
+
+    def test_whitespace(self):
+        field = u'b\ta\u00e9\u65e5'
+        assert predicates.oneGramFingerprint(field) == (u'ab\u00e9\u65e5',)
+        assert predicates.twoGramFingerprint(field) == (u'aa\u00e9b\u00e9\u65e5',)
+
+
 class TestMetaphone(unittest.TestCase):
     def test_metaphone_token(self):
         block_val = predicates.metaphoneToken('9301 S. State St. ')
         assert block_val == set([u'STT', u'S', u'ST'])
 
+    def test_phonetic_cache(self):
+        predicates.setPhoneticCacheSize(2)
+        try:
+            predicates.metaphoneToken('john smith')
+            predicates.metaphoneToken('john smith')
+            predicates.doubleMetaphone('jon')
+
+            info = predicates.phoneticCacheInfo()
+            assert info.hits == 2
+            assert info.misses == 3
+            assert info.maxsize == 2
+            assert info.currsize == 2
+            assert info.hit_rate == 0.4
+
+            assert predicates.doubleMetaphone('john') == {u'JN', u'AN'}
+        finally:
+            predicates.setPhoneticCacheSize()
+
+        assert predicates.phoneticCacheInfo().hit_rate == 0.0
+
 
 class TestWholeSet(unittest.TestCase):
     def setUp(self):
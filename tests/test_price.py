@@ -1,4 +1,7 @@
 import unittest
+
+import numpy
+
 from dedupe.variables.price import PriceType
 
 
@@ -6,3 +9,8 @@ class TestPrice(unittest.TestCase):
     def test_comparator(self):
         assert PriceType.comparator(1, 10) == 1
         assert PriceType.comparator(10, 1) == 1
+
+    def test_column_comparator(self):
+        numpy.testing.assert_array_almost_equal(
+            PriceType.column_comparator([1, 10, 0, 5], [10, 1, 5, -5]),
+            [1, 1, numpy.nan, numpy.nan])
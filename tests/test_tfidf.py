@@ -1,5 +1,9 @@
 import dedupe
+import os
+import pickle
+import tempfile
 import unittest
+from unittest import mock
 
 
 class ParsingTest(unittest.TestCase):
@@ -27,5 +31,180 @@ class ParsingTest(unittest.TestCase):
         assert len(self.index.search(('f*',))) == 1
 
 
+class UnindexTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [('foo', 'bar'), ('foo', 'baz'), ('bar', 'qux'),
+                     ('baz', 'qux'), ('foo', 'qux')]
+
+    def build(self):
+        index = dedupe.tfidf.TfIdfIndex()
+        for doc in self.docs:
+            index.index(doc)
+        index.initSearch()
+        return index
+
+    def test_unindex_all(self):
+        one_at_a_time = self.build()
+        for doc in self.docs[:3]:
+            one_at_a_time.unindex(doc)
+
+        batched = self.build()
+        init_searches = []
+        init_search = batched.initSearch
+
+        def countedInitSearch():
+            init_searches.append(1)
+            init_search()
+
+        batched.initSearch = countedInitSearch
+        batched.unindexAll(self.docs[:3])
+
+        assert len(init_searches) == 1
+        for doc in self.docs[3:]:
+            assert batched.search(doc) == one_at_a_time.search(doc)
+        assert batched.search(('foo', 'qux'), 0.5) == [5]
+
+
+class CsrIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [('foo', 'bar'), ('foo', 'baz'), ('bar', 'qux'),
+                     ('baz', 'qux'), ('foo', 'qux'), ('qux', 'qux', 'zip'),
+                     ('foo', 'bar'), ()]
+        self.queries = self.docs + [('foo', 'foo'), ('zap',), ('zap', 'bar')]
+
+    def build(self, index_class, docs):
+        index = index_class()
+        for doc in docs:
+            index.index(doc)
+        index.initSearch()
+        return index
+
+    def assertSameSearches(self, index, csr_index):
+        for threshold in (0, 0.3, 0.5, 0.9):
+            results = [index.search(query, threshold)
+                       for query in self.queries]
+            assert [csr_index.search(query, threshold)
+                    for query in self.queries] == results
+            assert csr_index.searchMany(self.queries, threshold) == results
+
+    def test_search(self):
+        index = self.build(dedupe.tfidf.TfIdfIndex, self.docs)
+        csr_index = self.build(dedupe.tfidf.CsrTfIdfIndex, self.docs)
+
+        assert dict(csr_index._doc_to_id) == dict(index._doc_to_id)
+        self.assertSameSearches(index, csr_index)
+        assert csr_index.searchMany([], 0.5) == []
+
+    def test_update(self):
+        index = self.build(dedupe.tfidf.TfIdfIndex, self.docs[:4])
+        csr_index = self.build(dedupe.tfidf.CsrTfIdfIndex, self.docs[:4])
+
+        for doc in self.docs[4:]:
+            index.index(doc)
+            csr_index.index(doc)
+        index.unindexAll(self.docs[1:3])
+        csr_index.unindexAll(self.docs[1:3])
+
+        self.assertSameSearches(index, csr_index)
+
+        loaded = pickle.loads(pickle.dumps(csr_index))
+        self.assertSameSearches(index, loaded)
+
+        with tempfile.TemporaryDirectory() as directory:
+            mmap_index = dedupe.mmap_index.writeIndex(csr_index, directory)
+            for query in self.queries:
+                assert mmap_index.search(query, 0.3) == \
+                    index.search(query, 0.3)
+
+
+class MmapIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.docs = [('foo', 'bar'), ('foo', 'baz'), ('bar', 'qux'),
+                     ('baz', 'qux'), ('foo', 'qux'), ('qux', 'qux', 'zip')]
+        self.index = dedupe.tfidf.TfIdfIndex()
+        for doc in self.docs:
+            self.index.index(doc)
+        self.index.initSearch()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.mmap_index = dedupe.mmap_index.writeIndex(
+            self.index, os.path.join(self.directory.name, 'index'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_search(self):
+        queries = self.docs + [('foo', 'foo'), ('zap',), ('zap', 'bar'), ()]
+        for threshold in (0, 0.3, 0.5, 0.9):
+            for query in queries:
+                assert self.mmap_index.search(query, threshold) == \
+                    self.index.search(query, threshold)
+
+        loaded = pickle.loads(pickle.dumps(self.mmap_index))
+        assert loaded.search(('foo', 'qux'), 0.5) == \
+            self.index.search(('foo', 'qux'), 0.5)
+
+    def test_doc_ids(self):
+        doc_to_id = self.mmap_index._doc_to_id
+        for doc in self.docs:
+            assert doc_to_id[doc] == self.index._doc_to_id[doc]
+
+        assert ('zap',) not in doc_to_id
+        assert doc_to_id[('zap',)] == len(self.docs) + 1
+        assert ('zap',) in doc_to_id
+
+    def test_index_unindex(self):
+        csr_index = dedupe.tfidf.CsrTfIdfIndex()
+        for index in (self.mmap_index, csr_index):
+            for doc in self.docs + [('zip', 'zap'), ('foo', 'zap')]:
+                index.index(doc)
+            index.initSearch()
+            index.unindexAll([('foo', 'bar'), ('foo', 'zap')])
+
+        doc_to_id = self.mmap_index._doc_to_id
+        assert ('foo', 'bar') not in doc_to_id
+        assert ('foo', 'zap') not in doc_to_id
+        assert doc_to_id[('zip', 'zap')] == csr_index._doc_to_id[('zip', 'zap')]
+        assert len(doc_to_id) == len(csr_index._doc_to_id)
+
+        queries = self.docs + [('zap',), ('zip', 'zap'), ('foo', 'zap')]
+        for threshold in (0, 0.3, 0.5, 0.9):
+            for query in queries:
+                assert self.mmap_index.search(query, threshold) == \
+                    csr_index.search(query, threshold)
+
+    def test_hash_collisions(self):
+        queries = self.docs + [('foo', 'foo'), ('zap',), ('zap', 'bar')]
+        expected = [self.mmap_index.search(query, 0.3) for query in queries]
+
+        path = os.path.join(self.directory.name, 'collisions')
+        with mock.patch.object(dedupe.mmap_index, 'hashKey',
+                               lambda string: 0):
+            colliding = dedupe.mmap_index.writeIndex(self.index, path)
+
+            assert [colliding.search(query, 0.3)
+                    for query in queries] == expected
+
+            for doc in self.docs:
+                assert colliding._doc_to_id[doc] == self.index._doc_to_id[doc]
+            assert ('zap',) not in colliding._doc_to_id
+
+    def test_canopy(self):
+        path = os.path.join(self.directory.name, 'canopy.npy')
+        canopy = dedupe.mmap_index.writeCanopy({1: 1, 2: 1, 4: None}, path)
+
+        assert canopy[2] == 1
+        assert canopy[4] is None
+        assert 3 not in canopy
+        self.assertRaises(KeyError, canopy.__getitem__, 3)
+
+        canopy[7] = None
+        assert canopy[7] is None
+
+        loaded = pickle.loads(pickle.dumps(canopy))
+        assert 7 not in loaded
+        assert loaded[1] == 1
+
+
 if __name__ == "__main__":
     unittest.main()